@@ -1,2 +1,12 @@
 from .mlol_client import MLOLClient
+from .mlol_async_client import AsyncMLOLClient
+from .mlol_catalog import MLOLCatalogCrawler, MLOLCatalogIndex, MLOLCatalogSync
+from .mlol_cache import MLOLBookCache, MemoryBookCache, SQLiteBookCache
+from .mlol_download import MLOLBulkDownloader
+from .mlol_library_mapping import MLOLLibraryMapping, SQLiteLibraryMapping
+from .mlol_pool import MLOLClientPool
+from .mlol_policies import MLOLDeadlineExceeded, deadline
+from .mlol_ratelimit import MLOLRateLimiter
+from .mlol_session_store import MLOLSessionStore
 from .mlol_types import MLOLBook, MLOLLoan, MLOLReservation, MLOLUser
+from .mlol_watch import MLOLAvailabilityWatcher
@@ -0,0 +1,650 @@
+import asyncio
+import logging
+import re
+from typing import AsyncGenerator, Awaitable, Iterable, List, Optional
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from .mlol_client import MLOLApiConverter, MLOLClient
+from .mlol_constants import (
+    WEB_ENDPOINTS,
+    API_ENDPOINTS,
+    DEFAULT_API_HEADERS,
+    DEFAULT_WEB_HEADERS,
+    DEFAULT_HTML_PARSER,
+    FULFILLMENT_TOKEN_PREFIX,
+    LATEST_BOOKS_FILTER,
+    RESOURCE_TYPES,
+)
+from .mlol_library_mapping import MLOLLibraryMapping, _get_default_library_mapping
+from .mlol_types import MLOLBook, MLOLReservation, MLOLUser
+from .mlol_parsers import (
+    _check_book_fields,
+    _check_html_parser,
+    _get_book_page_strainer,
+    _make_soup,
+    _parse_search_page,
+    _parse_book_page,
+    _parse_reservation,
+)
+
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+RETRY_METHODS = ["HEAD", "GET", "OPTIONS"]
+
+
+class AsyncMLOLClient:
+    max_retries = 3
+    backoff_factor = 1
+    domain = None
+    library_id = None
+    api_token = None
+
+    def __init__(
+        self,
+        *,
+        domain: str = None,
+        username: str = None,
+        password: str = None,
+        library_id: str = None,
+        max_concurrency: int = 20,
+        max_connections: int = 100,
+        parser: str = DEFAULT_HTML_PARSER,
+        library_mapping: MLOLLibraryMapping = None,
+    ):
+        if httpx is None:
+            raise ImportError(
+                "AsyncMLOLClient requires httpx. Install it with `pip install mlol_client[async]`."
+            )
+
+        base_url = "https://medialibrary.it"
+        if domain:
+            self.domain = domain
+            base_url = "https://" + re.sub(r"https?(://)", "", domain.rstrip("/"))
+
+        if library_id and isinstance(library_id, int):
+            library_id = str(library_id)
+        self.library_id = library_id
+        self.username = username
+        self._password = password
+        self.max_concurrency = max_concurrency
+        self.parser = _check_html_parser(parser)
+        self.library_mapping = library_mapping or _get_default_library_mapping()
+        self._semaphore = None
+
+        limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections
+        )
+        self.session = httpx.AsyncClient(
+            base_url=base_url,
+            headers=DEFAULT_WEB_HEADERS,
+            limits=limits,
+            transport=httpx.AsyncHTTPTransport(limits=limits, retries=1),
+            follow_redirects=True,
+            event_hooks={"response": [self._assert_status]},
+        )
+        self.api_session = httpx.AsyncClient(
+            headers=DEFAULT_API_HEADERS,
+            limits=limits,
+            transport=httpx.AsyncHTTPTransport(limits=limits, retries=1),
+        )
+
+    def __repr__(self):
+        values = {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
+        return f"<mlol_client.AsyncMLOLClient: {values}"
+
+    async def __aenter__(self):
+        await self.login()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.session.aclose()
+        await self.api_session.aclose()
+
+    # reuse the library mapping of the synchronous client
+    _get_saved_library_id = MLOLClient._get_saved_library_id
+    _update_library_mapping = MLOLClient._update_library_mapping
+
+    def _soup(self, markup: str):
+        return _make_soup(markup, self.parser)
+
+    @staticmethod
+    async def _assert_status(response):
+        # redirects are handled by the callers, only fail on errors
+        if response.is_error:
+            await response.aread()
+            response.raise_for_status()
+
+    @property
+    def base_url(self) -> str:
+        return str(self.session.base_url).rstrip("/")
+
+    async def _request(self, method: str, url: str, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return await self.session.request(method, url, **kwargs)
+            except httpx.HTTPStatusError as e:
+                if (
+                    method.upper() not in RETRY_METHODS
+                    or e.response.status_code not in RETRY_STATUSES
+                    or attempt >= self.max_retries
+                ):
+                    raise
+            await asyncio.sleep(self.backoff_factor * (2**attempt))
+            attempt += 1
+
+    async def _gather(self, aws: Iterable[Awaitable]) -> list:
+        # the semaphore must be created inside the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def bounded(aw):
+            async with self._semaphore:
+                return await aw
+
+        return await asyncio.gather(*(bounded(aw) for aw in aws))
+
+    async def login(self) -> Optional[bool]:
+        if not (self.username and self._password and self.domain):
+            return
+
+        if not self.library_id:
+            self.library_id = self._get_saved_library_id()
+
+        return await self._authenticate(
+            username=self.username,
+            password=self._password,
+            library_id=self.library_id,
+        )
+
+    async def _login_web(self, *, username: str, password: str, library_id: str):
+        headers = {
+            "Host": self.domain.replace("https://", ""),
+            "Origin": self.domain,
+            "Referer": f"{self.base_url}/user/logform.aspx",
+        }
+        data = {"lusername": username, "lpassword": password, "lente": library_id}
+        response = await self.session.request(
+            "POST",
+            url=WEB_ENDPOINTS["login"],
+            headers=headers,
+            data=data,
+            follow_redirects=False,
+        )
+        if response.headers.get("Location") == "/media/esplora.aspx":
+            return True
+
+        return False
+
+    async def _authenticate(
+        self, username: str, password: str, library_id: str
+    ) -> Optional[bool]:
+        if not library_id:
+            response = await self._request("GET", url=WEB_ENDPOINTS["index"])
+            soup = self._soup(response.text)
+            # get all "lente" values for subdomain, try all
+            if library_id_els := soup.select("#lente > option"):
+                library_id_values = [
+                    o.attrs["value"] for o in library_id_els if "value" in o.attrs
+                ]
+                for l_id in library_id_values:
+                    if await self._login_web(
+                        username=username, password=password, library_id=l_id
+                    ):
+                        logging.debug(
+                            f"Found library ID for username {username} on {self.domain}: {l_id}"
+                        )
+                        self.library_id = l_id
+                        self._update_library_mapping(l_id)
+                        break
+
+            if not self.library_id:
+                logging.error(
+                    "Login failed. Please make sure your credentials are valid or try to specify a manual library ID."
+                )
+                return
+        else:
+            if not await self._login_web(
+                username=username, password=password, library_id=library_id
+            ):
+                logging.error(
+                    "Login failed. Please make sure your credentials are valid."
+                )
+                return False
+
+        if api_token := await self._get_api_token(
+            username=username, password=password, library_id=self.library_id
+        ):
+            self.api_token = api_token
+        else:
+            logging.error("Failed to retrieve your API token.")
+            return
+
+        return True
+
+    async def _get_api_token(
+        self, username: str, password: str, library_id: str
+    ) -> Optional[str]:
+        data = await self._api_request(
+            method="POST",
+            url=API_ENDPOINTS["login"],
+            data={
+                "username": username,
+                "password": password,
+                "portal": library_id,
+                "app_code": "",
+            },
+        )
+
+        return data["token"] if data and "token" in data else None
+
+    async def _api_request(self, **kwargs) -> Optional[dict]:
+        if self.api_token:
+            kwargs["params"] = {**kwargs.get("params", {}), "token": self.api_token}
+
+        response = await self.api_session.request(**kwargs)
+        response.raise_for_status()
+        if "application/json" in response.headers["Content-Type"]:
+            return response.json()
+
+        logging.error(f"Unexpected API response: {response.text[:100]}")
+        return
+
+    async def _get_queue_position(self, reservation_id: str) -> Optional[int]:
+        response = await self._request(
+            "GET",
+            url=WEB_ENDPOINTS["get_queue_position"],
+            params={"id": reservation_id},
+        )
+
+        if "in coda" in response.text and (
+            queue_position := re.search(r"\d+(?=°)", response.text)
+        ):
+            return int(queue_position.group())
+
+        logging.error(f"Failed to get queue position for reservation #{reservation_id}")
+        return
+
+    async def _get_reservations(self) -> List[MLOLReservation]:
+        reservations = []
+        response = await self._request("GET", WEB_ENDPOINTS["resources"])
+        soup = self._soup(response.text)
+
+        if reservations_el := soup.select_one("#mlolreservation"):
+            for i, reservation_el in enumerate(
+                reservations_el.select("div.bottom-buffer")
+            ):
+                if reservation := _parse_reservation(reservation_el, index=i):
+                    reservations.append(reservation)
+
+        queue_positions = await self._gather(
+            self._get_queue_position(r.id) for r in reservations
+        )
+        for reservation, queue_position in zip(reservations, queue_positions):
+            reservation.queue_position = queue_position
+
+        return reservations
+
+    async def get_book_by_id(
+        self, book_id: str, *, fields: Iterable[str] = None
+    ) -> Optional[MLOLBook]:
+        fields = _check_book_fields(fields)
+        logging.debug(f"Fetching book {book_id}")
+        response = await self._request(
+            "GET", url=WEB_ENDPOINTS["get_book"], params={"id": book_id}
+        )
+        if "alert.aspx" in str(response.url):
+            logging.warning(
+                f"Failed to fetch book {book_id}. Might not be available to your library."
+            )
+            return None
+
+        soup = _make_soup(
+            response.text, self.parser, parse_only=_get_book_page_strainer(fields)
+        )
+        book_data = _parse_book_page(soup, fields)
+        if book_data["title"] is None:
+            logging.warning(f"Failed to get book title for id {book_id}, skipping...")
+            return None
+
+        return MLOLBook(id=book_id, **book_data)
+
+    async def get_book(
+        self, book: MLOLBook, *, fields: Iterable[str] = None
+    ) -> Optional[MLOLBook]:
+        if not isinstance(book, MLOLBook):
+            raise ValueError(f"Expected MLOLBook, got {type(book)}")
+
+        return await self.get_book_by_id(book.id, fields=fields)
+
+    async def get_books_by_id(
+        self, book_ids: Iterable[str], *, fields: Iterable[str] = None
+    ) -> List[Optional[MLOLBook]]:
+        return await self._gather(
+            self.get_book_by_id(i, fields=fields) for i in book_ids
+        )
+
+    async def _search_books_paginated(
+        self, *, params: dict, deep: bool = False, fields: Iterable[str] = None
+    ) -> AsyncGenerator[List[MLOLBook], None]:
+        response = await self._request(
+            "GET", url=WEB_ENDPOINTS["search"], params=params
+        )
+        soup = self._soup(response.text)
+
+        try:
+            pages = int(soup.select_one("#pager").attrs["data-pages"])
+        except AttributeError:
+            pages = 1
+
+        for i in range(1, pages + 1):
+            if i > 1:
+                response = await self._request(
+                    "GET",
+                    url=WEB_ENDPOINTS["search"],
+                    params={**params, **{"page": i}},
+                )
+                soup = self._soup(response.text)
+
+            books = _parse_search_page(soup)
+            if deep:
+                yield await self.get_books_by_id((b.id for b in books), fields=fields)
+            else:
+                yield books
+
+    async def search_books(
+        self,
+        query: str,
+        *,
+        deep: bool = False,
+        fields: Iterable[str] = None,
+        only_available: bool = False,
+    ) -> AsyncGenerator[List[MLOLBook], None]:
+        params = {"seltip": 310, "keywords": query.strip(), "nris": 48}
+        if only_available:
+            if not self.is_logged_in():
+                logging.error("You need to be logged in to check for available books.")
+                return
+            params.update({"chkdispo": "on"})
+
+        fields = _check_book_fields(fields)
+        async for page in self._search_books_paginated(
+            params=params, deep=deep, fields=fields
+        ):
+            yield page
+
+    async def get_latest_books(
+        self,
+        *,
+        deep: bool = False,
+        fields: Iterable[str] = None,
+        only_available: bool = False,
+    ) -> AsyncGenerator[List[MLOLBook], None]:
+        params = {"seltip": 310, "news": LATEST_BOOKS_FILTER, "nris": 48}
+        if only_available:
+            if not self.is_logged_in():
+                logging.error("You need to be logged in to check for available books.")
+                return
+            params.update({"chkdispo": "on"})
+
+        fields = _check_book_fields(fields)
+        async for page in self._search_books_paginated(
+            params=params, deep=deep, fields=fields
+        ):
+            yield page
+
+    async def reserve_book_by_id(self, book_id: str, *, email: str) -> Optional[bool]:
+        if not self.is_logged_in():
+            logging.error(
+                "You need to be authenticated to MLOL in order to download books."
+            )
+            return
+
+        book = await self.get_book_by_id(book_id)
+        if book and book.status != "taken":
+            logging.error(
+                f"You can only reserve taken books. Book status: {book.status}"
+            )
+
+        headers = {
+            "Host": self.base_url.replace("https://", ""),
+            "Referer": f"{self.base_url}{WEB_ENDPOINTS['pre_reserve']}?id={book_id}",
+            "Accept": "text/html, */*; q=0.01",
+        }
+        response = await self._request(
+            "GET",
+            # don't pass params, build the URL directly to avoid percent encoding
+            url=f"{WEB_ENDPOINTS['reserve']}?id={book_id}&email={email}",
+            headers=headers,
+        )
+        soup = self._soup(response.text)
+        if outcome := soup.select_one("#lblInfo"):
+            message = outcome.text.strip().lower()
+            if "con successo" in message:
+                return True
+            elif "prenotazione attiva" in message:
+                logging.warning(
+                    f"You already have an active reservation for book #{book_id}"
+                )
+                return True
+            else:
+                logging.error(f"Failed to reserve book #{book_id}")
+                return False
+
+        logging.error(f"Failed to reserve book with ID {book_id} (unknown outcome)")
+
+    async def reserve_book(self, book: MLOLBook, *, email: str) -> Optional[bool]:
+        if not isinstance(book, MLOLBook):
+            raise ValueError(f"Expected MLOLBook, got {type(book)}")
+
+        return await self.reserve_book_by_id(book.id, email=email)
+
+    async def cancel_reservation_by_id(self, reservation_id: str) -> Optional[bool]:
+        headers = {
+            "Host": self.base_url.replace("https://", ""),
+            "Referer": f"{self.base_url}/user/risorse.aspx",
+        }
+        response = await self._request(
+            "GET",
+            url=WEB_ENDPOINTS["cancel_reservation"],
+            headers=headers,
+            params={"id": reservation_id},
+            follow_redirects=False,
+        )
+        redirect_url = response.headers.get("Location", "")
+
+        if redirect_url.endswith("msg=970"):
+            # this is a "success" redirect
+            return True
+        elif redirect_url.endswith("msg=960"):
+            # "error" redirect
+            logging.error(f"Failed to cancel reservation #{reservation_id}")
+            return False
+        else:
+            logging.error(
+                f"Failed to cancel reservation #{reservation_id} (unknown outcome)"
+            )
+
+    async def cancel_book_reservation(self, book: MLOLBook) -> Optional[bool]:
+        if not isinstance(book, MLOLBook):
+            raise ValueError(f"Expected MLOLBook, got {type(book)}")
+
+        if not self.is_logged_in():
+            logging.error(
+                "You need to be authenticated to MLOL in order to manage reservations."
+            )
+            return
+
+        if book.status is None:
+            book = await self.get_book_by_id(book.id)
+
+        if book is None or book.status != "reserved":
+            logging.error(
+                f"You don't have book #{book.id if book else ''} reserved. Status: {book.status if book else None}"
+            )
+            return False
+
+        for reservation in await self._get_reservations():
+            if reservation.book.id == book.id:
+                return await self.cancel_reservation_by_id(reservation.id)
+
+        logging.error(
+            f"Could not cancel reservation for book #{book.id} (reservation ID not found)"
+        )
+        return
+
+    async def get_resources(self, *, deep=False, include: Iterable[str] = None) -> dict:
+        # include: some of RESOURCE_TYPES, all of them by default
+        include = frozenset(RESOURCE_TYPES if include is None else include)
+        if unknown := include - set(RESOURCE_TYPES):
+            raise ValueError(
+                f"Unknown resources: {', '.join(sorted(unknown))}. "
+                f"Supported resources: {', '.join(RESOURCE_TYPES)}"
+            )
+
+        async def skip():
+            return None
+
+        reservations, loan_response, loan_history_response = await asyncio.gather(
+            self._get_reservations() if "reservations" in include else skip(),
+            self._api_request(method="GET", url=API_ENDPOINTS["loans"])
+            if "active_loans" in include
+            else skip(),
+            self._api_request(method="GET", url=API_ENDPOINTS["loan_history"])
+            if "loan_history" in include
+            else skip(),
+        )
+
+        resources = {}
+        if reservations is not None:
+            resources["reservations"] = reservations
+        if loan_response and "loans" in loan_response:
+            resources["active_loans"] = [
+                MLOLApiConverter.get_loan(l) for l in loan_response["loans"]
+            ]
+        if loan_history_response and "loans" in loan_history_response:
+            resources["loan_history"] = [
+                MLOLApiConverter.get_loan(l) for l in loan_history_response["loans"]
+            ]
+
+        if deep:
+            items = [
+                item
+                for k in ["reservations", "active_loans", "loan_history"]
+                for item in resources.get(k, [])
+                if item
+            ]
+            book_ids = list(dict.fromkeys(item.book.id for item in items))
+            books = dict(zip(book_ids, await self.get_books_by_id(book_ids)))
+            for item in items:
+                if book := books[item.book.id]:
+                    item.book = book
+
+        return resources
+
+    async def get_user(self) -> Optional[MLOLUser]:
+        data = await self._api_request(method="GET", url=API_ENDPOINTS["userinfo"])
+        if data:
+            return MLOLApiConverter.get_user(data)
+
+    def is_logged_in(self) -> bool:
+        return (
+            self.session.cookies.get(".ASPXAUTH") is not None
+            and self.api_token is not None
+        )
+
+    async def _redownload_owned_book(self, book_id: str):
+        resources = await self.get_resources(include={"active_loans"})
+        active_loans = resources.get("active_loans", [])
+        if loan_id := next((l.id for l in active_loans if l.book.id == book_id), None):
+            return await self._request(
+                "GET",
+                url=WEB_ENDPOINTS["redownload"],
+                headers={
+                    "Host": self.base_url.replace("https://", ""),
+                    "Referer": f"{self.base_url}/help/helpdeskdl.aspx?idp={loan_id}",
+                },
+                params={"idp": loan_id},
+                follow_redirects=False,
+            )
+
+        logging.error(f"Failed to find owned book {book_id} in your profile")
+        return
+
+    async def download_book_by_id(
+        self, book_id: str, download_format: str = "epub"
+    ) -> Optional[bytes]:
+        if not self.is_logged_in():
+            logging.error(
+                "You need to be authenticated to MLOL in order to download books."
+            )
+            return
+
+        book = await self.get_book_by_id(book_id)
+        if book is None:
+            return
+        if book.drm != "adobe":
+            logging.error(
+                "Your book has {} DRM. Only Adobe DRM downloads are supported as of now.".format(
+                    book.drm if book.drm else "no"
+                )
+            )
+            return
+        if book.status == "owned":
+            logging.info("You already own this book. Redownloading...")
+            response = await self._redownload_owned_book(book_id)
+            if response is None:
+                return
+        elif book.status != "available":
+            logging.error(f"Book is not available for download. Status: {book.status}")
+            return
+        else:
+            download_format = (
+                "epub"
+                if "epub" in book.formats
+                else "pdf"
+                if "pdf" in book.formats
+                else book.formats[0]
+            )
+            response = await self._request(
+                "GET",
+                url=WEB_ENDPOINTS["download"],
+                headers={
+                    "Host": self.base_url.replace("https://", ""),
+                    "Referer": f"{self.base_url}/media/downloadebad2.aspx?unid={book_id}&form={download_format}",
+                },
+                params={"unid": book_id, "form": download_format},
+                follow_redirects=False,
+            )
+
+        if response.status_code == 302:
+            response = await self._request(
+                "GET",
+                url=response.headers["Location"],
+                headers={"Sec-Fetch-Site": "cross-site"},
+            )
+
+        if response.content.startswith(FULFILLMENT_TOKEN_PREFIX):
+            logging.info(f"Book {book_id} downloaded")
+            return response.content
+        else:
+            logging.error(f"Failed to download book {book_id}")
+            return None
+
+    async def download_book(self, book: MLOLBook) -> Optional[bytes]:
+        if not isinstance(book, MLOLBook):
+            raise ValueError(f"Expected MLOLBook, got {type(book)}")
+
+        return await self.download_book_by_id(book.id)
+
+    def get_book_url_by_id(self, book_id: str) -> str:
+        return f"{self.base_url}{WEB_ENDPOINTS['get_book']}?id={book_id}"
+
+    def get_book_url(self, book: MLOLBook) -> str:
+        return self.get_book_url_by_id(book.id)
@@ -0,0 +1,368 @@
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from copy import deepcopy
+from typing import Dict, Iterable, Optional, Tuple
+
+from .mlol_types import MLOLBook
+
+# one week for data that never changes, one minute for availability
+DEFAULT_METADATA_TTL = 7 * 24 * 60 * 60
+DEFAULT_STATUS_TTL = 60
+
+
+def _get_account_domain(domain: str, account: str) -> str:
+    # the key of the statuses seen by an account
+    return f"{account}@{domain}"
+
+
+class MLOLBookCache(ABC):
+    # metadata (title, authors, ISBNs, formats...) and status are stored with
+    # separate timestamps, so that status can expire much sooner
+
+    def __init__(
+        self,
+        *,
+        metadata_ttl: float = DEFAULT_METADATA_TTL,
+        status_ttl: float = DEFAULT_STATUS_TTL,
+    ):
+        self.metadata_ttl = metadata_ttl
+        self.status_ttl = status_ttl
+        self.hits = 0
+        self.misses = 0
+        # resolve_isbns lookups, counted apart from books
+        self.isbn_hits = 0
+        self.isbn_misses = 0
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return f"<mlol_client.{type(self).__name__}: {self.stats}>"
+
+    @property
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+    @property
+    def isbn_stats(self) -> dict:
+        return {"hits": self.isbn_hits, "misses": self.isbn_misses}
+
+    def _miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def _hit(self) -> None:
+        with self._lock:
+            self.hits += 1
+
+    def get(
+        self,
+        domain: str,
+        book_id: str,
+        *,
+        with_status: bool = True,
+        account: str = None,
+    ) -> Optional[MLOLBook]:
+        # with_status=False returns books with expired status too (status=None).
+        # Status depends on the patron (owned, reserved...): with an account,
+        # the status cached for that account is used, metadata is shared
+        book_id = str(book_id)
+        now = time.time()
+        entry = self._load(domain, book_id)
+        if entry is None:
+            self._miss()
+            return None
+
+        data, metadata_time, status_time = entry
+        if now - metadata_time > self.metadata_ttl:
+            self._delete(domain, book_id)
+            self._miss()
+            return None
+
+        if account is not None:
+            status_entry = self._load(_get_account_domain(domain, account), book_id)
+            data["status"], status_time = (
+                (status_entry[0]["status"], status_entry[2])
+                if status_entry is not None
+                else (None, None)
+            )
+        status_fresh = status_time is not None and now - status_time <= self.status_ttl
+        if with_status and not status_fresh:
+            self._miss()
+            return None
+
+        book = MLOLBook.from_dict({**data, "id": book_id})
+        if not status_fresh:
+            book.status = None
+
+        self._hit()
+        return book
+
+    def set(self, domain: str, book: MLOLBook, *, account: str = None) -> None:
+        data = deepcopy(book.to_dict())
+        del data["id"]
+        now = time.time()
+        if account is None:
+            self._store(domain, book.id, data, now, now)
+            return
+
+        # account statuses are stored apart, keep the one of anonymous clients
+        status = data.pop("status")
+        with self._lock:
+            entry = self._load(domain, book.id)
+            data["status"], status_time = (
+                (entry[0]["status"], entry[2]) if entry is not None else (None, None)
+            )
+            self._store(domain, book.id, data, now, status_time)
+        self._store(
+            _get_account_domain(domain, account), book.id, {"status": status}, now, now
+        )
+
+    def invalidate(
+        self, domain: str = None, book_id: str = None, *, status_only: bool = False
+    ) -> None:
+        # None domain/book_id match everything. A domain matches the statuses
+        # of all its accounts too
+        book_id = str(book_id) if book_id is not None else None
+        if status_only:
+            self._delete_status(domain, book_id)
+        else:
+            self._delete(domain, book_id)
+
+    def clear(self) -> None:
+        self.invalidate()
+        self._delete_isbns(None)
+
+    def get_isbns(self, domain: str, isbns: Iterable[str]) -> Dict[str, Optional[str]]:
+        # ISBN -> book id for cached ISBNs only, None if the library doesn't have it
+        isbns = list(isbns)
+        now = time.time()
+        entries = self._load_isbns(domain, isbns)
+        result = {
+            isbn: book_id
+            for isbn, (book_id, resolve_time) in entries.items()
+            if now - resolve_time <= self.metadata_ttl
+        }
+        with self._lock:
+            self.isbn_hits += len(result)
+            self.isbn_misses += len(isbns) - len(result)
+        return result
+
+    def set_isbns(self, domain: str, mapping: Dict[str, Optional[str]]) -> None:
+        self._store_isbns(domain, mapping, time.time())
+
+    @abstractmethod
+    def _load(self, domain: str, book_id: str) -> Optional[Tuple[dict, float, float]]:
+        pass
+
+    @abstractmethod
+    def _store(
+        self,
+        domain: str,
+        book_id: str,
+        data: dict,
+        metadata_time: float,
+        status_time: float,
+    ) -> None:
+        pass
+
+    @abstractmethod
+    def _delete(self, domain: Optional[str], book_id: Optional[str]) -> None:
+        pass
+
+    @abstractmethod
+    def _delete_status(self, domain: Optional[str], book_id: Optional[str]) -> None:
+        pass
+
+    @abstractmethod
+    def _load_isbns(
+        self, domain: str, isbns: list
+    ) -> Dict[str, Tuple[Optional[str], float]]:
+        pass
+
+    @abstractmethod
+    def _store_isbns(
+        self, domain: str, mapping: Dict[str, Optional[str]], resolve_time: float
+    ) -> None:
+        pass
+
+    @abstractmethod
+    def _delete_isbns(self, domain: Optional[str]) -> None:
+        pass
+
+
+class MemoryBookCache(MLOLBookCache):
+    def __init__(self, *, maxsize: int = 10000, **kwargs):
+        super().__init__(**kwargs)
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._isbns = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _matching_keys(self, domain: Optional[str], book_id: Optional[str]):
+        return [
+            k
+            for k in self._entries
+            if (domain is None or k[0] == domain or k[0].endswith(f"@{domain}"))
+            and (book_id is None or k[1] == book_id)
+        ]
+
+    def _load(self, domain, book_id):
+        with self._lock:
+            if (entry := self._entries.get((domain, book_id))) is None:
+                return None
+            self._entries.move_to_end((domain, book_id))
+            data, metadata_time, status_time = entry
+            return deepcopy(data), metadata_time, status_time
+
+    def _store(self, domain, book_id, data, metadata_time, status_time):
+        with self._lock:
+            self._entries[(domain, book_id)] = [data, metadata_time, status_time]
+            self._entries.move_to_end((domain, book_id))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _delete(self, domain, book_id):
+        with self._lock:
+            for k in self._matching_keys(domain, book_id):
+                del self._entries[k]
+
+    def _delete_status(self, domain, book_id):
+        with self._lock:
+            for k in self._matching_keys(domain, book_id):
+                self._entries[k][2] = None
+
+    def _load_isbns(self, domain, isbns):
+        with self._lock:
+            return {
+                isbn: entry
+                for isbn in isbns
+                if (entry := self._isbns.get((domain, isbn))) is not None
+            }
+
+    def _store_isbns(self, domain, mapping, resolve_time):
+        with self._lock:
+            for isbn, book_id in mapping.items():
+                self._isbns[(domain, isbn)] = (book_id, resolve_time)
+                self._isbns.move_to_end((domain, isbn))
+            while len(self._isbns) > self.maxsize:
+                self._isbns.popitem(last=False)
+
+    def _delete_isbns(self, domain):
+        with self._lock:
+            for k in [k for k in self._isbns if domain is None or k[0] == domain]:
+                del self._isbns[k]
+
+
+class SQLiteBookCache(MLOLBookCache):
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS books (
+                    domain TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    metadata_time REAL NOT NULL,
+                    status_time REAL,
+                    PRIMARY KEY (domain, id)
+                )"""
+            )
+            # id is NULL for ISBNs the library doesn't have
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS isbns (
+                    domain TEXT NOT NULL,
+                    isbn TEXT NOT NULL,
+                    id TEXT,
+                    resolve_time REAL NOT NULL,
+                    PRIMARY KEY (domain, isbn)
+                )"""
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    @staticmethod
+    def _where(domain: Optional[str], book_id: Optional[str]) -> Tuple[str, list]:
+        clauses, params = [], []
+        if domain is not None:
+            clauses.append("(domain = ? OR domain GLOB ?)")
+            params += [domain, f"*@{domain}"]
+        if book_id is not None:
+            clauses.append("id = ?")
+            params.append(book_id)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def _load(self, domain, book_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data, metadata_time, status_time FROM books WHERE domain = ? AND id = ?",
+                (domain, book_id),
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2]
+
+    def _store(self, domain, book_id, data, metadata_time, status_time):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?)",
+                (
+                    domain,
+                    book_id,
+                    json.dumps(data, ensure_ascii=False),
+                    metadata_time,
+                    status_time,
+                ),
+            )
+
+    def _delete(self, domain, book_id):
+        where, params = self._where(domain, book_id)
+        with self._lock, self._connection:
+            self._connection.execute(f"DELETE FROM books{where}", params)
+
+    def _delete_status(self, domain, book_id):
+        where, params = self._where(domain, book_id)
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"UPDATE books SET status_time = NULL{where}", params
+            )
+
+    def _load_isbns(self, domain, isbns):
+        rows = []
+        with self._lock:
+            # stay below SQLite's limit on query parameters
+            for i in range(0, len(isbns), 500):
+                chunk = isbns[i : i + 500]
+                rows += self._connection.execute(
+                    "SELECT isbn, id, resolve_time FROM isbns WHERE domain = ? "
+                    f"AND isbn IN ({', '.join('?' * len(chunk))})",
+                    (domain, *chunk),
+                ).fetchall()
+        return {isbn: (book_id, resolve_time) for isbn, book_id, resolve_time in rows}
+
+    def _store_isbns(self, domain, mapping, resolve_time):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO isbns VALUES (?, ?, ?, ?)",
+                [
+                    (domain, isbn, book_id, resolve_time)
+                    for isbn, book_id in mapping.items()
+                ],
+            )
+
+    def _delete_isbns(self, domain):
+        where, params = self._where(domain, None)
+        with self._lock, self._connection:
+            self._connection.execute(f"DELETE FROM isbns{where}", params)
@@ -0,0 +1,425 @@
+import gzip
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from .mlol_client import MLOLClient
+from .mlol_constants import LATEST_BOOKS_DAYS
+from .mlol_parsers import _check_book_fields, _normalize_isbn, _parse_search_page
+from .mlol_policies import _in_context
+from .mlol_types import MLOLBook
+
+
+class MLOLCatalogCrawler:
+    # Streams search results to a JSONL file (gzipped if the path ends in .gz),
+    # one line per book. After every page, the output offset is appended to a
+    # checkpoint journal: a restarted crawl truncates the output to the last
+    # completed page and resumes from the next one.
+
+    def __init__(
+        self,
+        client: MLOLClient,
+        output_path: str,
+        *,
+        checkpoint_path: str = None,
+        query: str = "",
+        deep: bool = False,
+        fields: Iterable[str] = None,
+        max_workers: int = 4,
+    ):
+        self.client = client
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+        self.query = query.strip()
+        self.deep = deep
+        self.fields = _check_book_fields(fields)
+        self.max_workers = max(1, max_workers)
+        self.compress = output_path.endswith(".gz")
+
+    def __repr__(self):
+        return f"<mlol_client.{type(self).__name__}: {self.output_path}>"
+
+    @property
+    def _params(self) -> dict:
+        return {"seltip": 310, "keywords": self.query, "nris": 48}
+
+    @property
+    def _header(self) -> dict:
+        return {
+            "query": self.query,
+            "deep": self.deep,
+            "fields": sorted(self.fields) if self.fields is not None else None,
+            "compress": self.compress,
+        }
+
+    def _read_checkpoint(self) -> Optional[dict]:
+        # returns the last completed page, {"page": 0, "offset": 0} for new crawls
+        if not os.path.exists(self.checkpoint_path):
+            return {"page": 0, "offset": 0}
+
+        with open(self.checkpoint_path, encoding="utf8") as f:
+            lines = f.read().splitlines()
+
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, json.JSONDecodeError):
+            return {"page": 0, "offset": 0}
+        if header != self._header:
+            logging.error(
+                f"Checkpoint {self.checkpoint_path} belongs to a different crawl: {header}"
+            )
+            return
+
+        last = {"page": 0, "offset": 0}
+        for line in lines[1:]:
+            try:
+                last = json.loads(line)
+            except json.JSONDecodeError:
+                # interrupted while writing the journal, the page is not complete
+                break
+
+        try:
+            output_size = os.path.getsize(self.output_path)
+        except OSError:
+            output_size = 0
+        if output_size < last["offset"]:
+            logging.warning(f"{self.output_path} is missing data, restarting crawl")
+            return {"page": 0, "offset": 0}
+        return last
+
+    def _write_checkpoint(self, page: int, offset: int) -> None:
+        with open(self.checkpoint_path, "a", encoding="utf8") as f:
+            if page == 0:
+                f.write(json.dumps(self._header) + "\n")
+            else:
+                f.write(json.dumps({"page": page, "offset": offset}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _encode(self, books: List[MLOLBook]) -> bytes:
+        data = "".join(
+            json.dumps(b.to_dict(), ensure_ascii=False) + "\n" for b in books
+        ).encode("utf8")
+        # a gzip member per page, so the file can be truncated at any checkpoint
+        return gzip.compress(data) if self.compress else data
+
+    def _get_page_books(self, page: int, response=None) -> List[MLOLBook]:
+        if response is None:
+            response = self.client._get_search_page(req_params=self._params, page=page)
+        return _parse_search_page(self.client._soup(response.text))
+
+    def run(self) -> Optional[int]:
+        # returns the number of books written by this run
+        if (checkpoint := self._read_checkpoint()) is None:
+            return
+
+        start_page = checkpoint["page"] + 1
+        if start_page == 1:
+            # new crawl, or the previous one died before completing a page
+            if os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+            self._write_checkpoint(0, 0)
+
+        first_response, pages = self.client._get_first_search_page(self._params)
+        if start_page > pages:
+            logging.info(f"Crawl already complete ({pages} pages)")
+            return 0
+
+        written = 0
+        get_page_books = _in_context(self._get_page_books)
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = deque()
+        next_page = start_page
+        with open(self.output_path, "r+b" if start_page > 1 else "wb") as f:
+            # drop anything written after the last checkpoint
+            f.truncate(checkpoint["offset"])
+            f.seek(checkpoint["offset"])
+            try:
+                while futures or next_page <= pages:
+                    while next_page <= pages and len(futures) < self.max_workers:
+                        futures.append(
+                            (
+                                next_page,
+                                executor.submit(
+                                    get_page_books,
+                                    next_page,
+                                    first_response if next_page == 1 else None,
+                                ),
+                            )
+                        )
+                        next_page += 1
+
+                    # pages are written in order, so the journal is a single offset
+                    page, future = futures.popleft()
+                    books = future.result()
+                    if self.deep and books:
+                        # details use the client's own pool, listing pages keep
+                        # downloading in the background meanwhile. hydrate raises
+                        # if a book fails: the page is neither written nor
+                        # checkpointed, and a resumed crawl fetches it again
+                        self.client.hydrate(books, fields=self.fields)
+                    f.write(self._encode(books))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._write_checkpoint(page, f.tell())
+                    written += len(books)
+                    logging.info(f"Crawled page {page}/{pages} ({len(books)} books)")
+            finally:
+                for _, future in futures:
+                    future.cancel()
+                executor.shutdown(wait=False)
+
+        return written
+
+
+def _open_catalog(path: str, mode: str, *, compress: bool = None):
+    if compress is None:
+        compress = path.endswith(".gz")
+    if compress:
+        return gzip.open(path, mode + "t", encoding="utf8")
+    return open(path, mode, encoding="utf8")
+
+
+class MLOLCatalogSync:
+    # Brings a catalog written by MLOLCatalogCrawler up to date using the
+    # latest additions only. The time of the last sync is kept in a small
+    # state file next to the catalog.
+
+    def __init__(
+        self,
+        client: MLOLClient,
+        catalog_path: str,
+        *,
+        state_path: str = None,
+        fields: Iterable[str] = None,
+        refresh_status: int = 100,
+    ):
+        self.client = client
+        self.catalog_path = catalog_path
+        self.state_path = state_path or f"{catalog_path}.sync"
+        self.fields = _check_book_fields(fields)
+        self.refresh_status = refresh_status
+
+    def __repr__(self):
+        return f"<mlol_client.{type(self).__name__}: {self.catalog_path}>"
+
+    @property
+    def last_sync(self) -> Optional[datetime]:
+        try:
+            with open(self.state_path, encoding="utf8") as f:
+                return datetime.fromisoformat(json.load(f)["last_sync"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _load_catalog(self) -> Optional[dict]:
+        try:
+            with _open_catalog(self.catalog_path, "r") as f:
+                return {(r := json.loads(line))["id"]: r for line in f if line.strip()}
+        except OSError:
+            logging.error(f"Could not read catalog {self.catalog_path}")
+            return
+
+    def _write_atomic(self, path: str, lines: Iterable[str]) -> None:
+        tmp_path = f"{path}.tmp"
+        with _open_catalog(tmp_path, "w", compress=path.endswith(".gz")) as f:
+            for line in lines:
+                f.write(line + "\n")
+        os.replace(tmp_path, path)
+
+    def run(self, *, refresh_ids: Iterable[str] = ()) -> Optional[dict]:
+        # refresh_ids are refreshed first, then known books among the latest ones
+        last_sync = self.last_sync
+        if last_sync and datetime.now() - last_sync > timedelta(days=LATEST_BOOKS_DAYS):
+            logging.warning(
+                f"Last sync was on {last_sync:%Y-%m-%d}, more than {LATEST_BOOKS_DAYS} days ago: "
+                "books added in between are missing, consider a full crawl"
+            )
+
+        if (catalog := self._load_catalog()) is None:
+            return
+
+        latest = {b.id: b for page in self.client.get_latest_books() for b in page}
+        new_books = [b for book_id, b in latest.items() if book_id not in catalog]
+        # books that fail are left as they are: unseen ones stay out of the
+        # catalog so that the next sync tries them again
+        errors = {}
+        if new_books:
+            self.client.hydrate(new_books, fields=self.fields, errors=errors)
+
+        # status is the only field that changes after publication
+        refresh = list(dict.fromkeys([*map(str, refresh_ids), *latest]))
+        refresh = [
+            MLOLBook.from_dict(catalog[book_id])
+            for book_id in refresh
+            if book_id in catalog
+        ][: self.refresh_status]
+        if refresh:
+            self.client.hydrate(refresh, fields={"status"}, errors=errors)
+
+        new_books = [b for b in new_books if b.id not in errors]
+        refresh = [b for b in refresh if b.id not in errors]
+        for book in [*refresh, *new_books]:
+            catalog[book.id] = book.to_dict()
+
+        self._write_atomic(
+            self.catalog_path,
+            (json.dumps(r, ensure_ascii=False) for r in catalog.values()),
+        )
+        if os.path.exists(checkpoint_path := f"{self.catalog_path}.checkpoint"):
+            # crawler offsets don't match the rewritten catalog anymore
+            os.remove(checkpoint_path)
+
+        result = {
+            "last_sync": datetime.now().isoformat(),
+            "added": len(new_books),
+            "refreshed": len(refresh),
+            "failed": len(errors),
+        }
+        self._write_atomic(self.state_path, [json.dumps(result)])
+        logging.info(f"Synced {self.catalog_path}: {result}")
+        return result
+
+
+def _tokenize(text: str) -> List[str]:
+    # lowercase, without accents: "Società" -> ["societa"]
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.findall(r"\w+", text)
+
+
+class MLOLCatalogIndex:
+    # In-memory index over a crawled catalog: words from title, authors,
+    # publisher and categories map to book ids, ISBNs map to books directly.
+
+    INDEXED_FIELDS = ("title", "authors", "publisher", "categories")
+
+    def __init__(
+        self,
+        books: Iterable[MLOLBook] = (),
+        *,
+        client: MLOLClient = None,
+        built_at: float = None,
+        max_age: float = None,
+    ):
+        self.client = client
+        self.built_at = built_at if built_at is not None else time.time()
+        self.max_age = max_age
+        self._books: Dict[str, MLOLBook] = {}
+        self._positions: Dict[str, int] = {}
+        self._words: Dict[str, Set[str]] = defaultdict(set)
+        self._isbns: Dict[str, str] = {}
+        for book in books:
+            self.add(book)
+
+    def __repr__(self):
+        return f"<mlol_client.{type(self).__name__}: {len(self)} books>"
+
+    def __len__(self):
+        return len(self._books)
+
+    @classmethod
+    def from_catalog(cls, path: str, **kwargs) -> "MLOLCatalogIndex":
+        # the index is as fresh as the last crawl or sync of the catalog
+        kwargs.setdefault("built_at", os.path.getmtime(path))
+        with _open_catalog(path, "r") as f:
+            return cls(
+                (MLOLBook.from_dict(json.loads(line)) for line in f if line.strip()),
+                **kwargs,
+            )
+
+    @property
+    def is_stale(self) -> bool:
+        return self.max_age is not None and time.time() - self.built_at > self.max_age
+
+    def _get_words(self, book: MLOLBook) -> Set[str]:
+        words = set()
+        for field in self.INDEXED_FIELDS:
+            value = book._get(field)
+            # authors are a list, categories a list of lists
+            for text in value if isinstance(value, list) else [value]:
+                for t in text if isinstance(text, list) else [text]:
+                    if t:
+                        words.update(_tokenize(t))
+        return words
+
+    def add(self, book: MLOLBook) -> None:
+        if book.id in self._books:
+            self.remove(book.id)
+        self._positions.setdefault(book.id, len(self._positions))
+        self._books[book.id] = book
+        for word in self._get_words(book):
+            self._words[word].add(book.id)
+        for isbn in book._get("ISBNs") or []:
+            self._isbns[_normalize_isbn(isbn)] = book.id
+
+    def remove(self, book_id: str) -> None:
+        if (book := self._books.pop(str(book_id), None)) is None:
+            return
+        for word in self._get_words(book):
+            self._words[word].discard(book.id)
+            if not self._words[word]:
+                del self._words[word]
+        for isbn in book._get("ISBNs") or []:
+            self._isbns.pop(_normalize_isbn(isbn), None)
+
+    def get_book_by_id(self, book_id: str) -> Optional[MLOLBook]:
+        return self._books.get(str(book_id))
+
+    def get_book_by_isbn(self, isbn: str) -> Optional[MLOLBook]:
+        if book_id := self._isbns.get(_normalize_isbn(isbn)):
+            return self._books[book_id]
+
+    def _match(self, query: str) -> Iterable[str]:
+        if re.fullmatch(r"[0-9X]{10}|[0-9X]{13}", isbn := _normalize_isbn(query)):
+            if book_id := self._isbns.get(isbn):
+                return [book_id]
+
+        if not (words := _tokenize(query)):
+            return self._books.keys()
+
+        # intersect starting from the rarest word
+        matches = sorted((self._words.get(w, set()) for w in words), key=len)
+        return sorted(set.intersection(*matches), key=self._positions.get)
+
+    def search(
+        self,
+        query: str = "",
+        *,
+        min_year: int = None,
+        max_year: int = None,
+        formats: Iterable[str] = None,
+        drm: str = None,
+        live_fallback: bool = False,
+    ) -> List[MLOLBook]:
+        # results are in catalog order. With live_fallback, a stale index
+        # forwards the query to the website instead (filters still apply)
+        filtered = any(f is not None for f in (min_year, max_year, formats, drm))
+        if live_fallback and self.is_stale and self.client is not None:
+            logging.info(f"Index is stale, searching {query!r} online")
+            # filters need book details, plain queries don't
+            pages = self.client.search_books(query, deep=filtered)
+            books = [b for page in pages for b in page if b is not None]
+            if filtered:
+                for book in books:
+                    self.add(book)
+        else:
+            books = [self._books[book_id] for book_id in self._match(query)]
+        if not filtered:
+            return books
+
+        formats = set(formats) if formats is not None else None
+        return [
+            b
+            for b in books
+            if (min_year is None or (b.year is not None and b.year >= min_year))
+            and (max_year is None or (b.year is not None and b.year <= max_year))
+            and (formats is None or formats & set(b.formats or []))
+            and (drm is None or b.drm == drm)
+        ]
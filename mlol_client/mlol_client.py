@@ -1,19 +1,18 @@
-import json
 import logging
 import os
 import re
+import threading
 import time
 from base64 import b64decode
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from datetime import datetime
-from shutil import copy
-from typing import Optional, List, Generator
+from functools import partial
+from typing import BinaryIO, Dict, Optional, List, Generator, Iterable, Tuple, Union
 
 import requests
-from bs4 import BeautifulSoup
-from requests.adapters import HTTPAdapter
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
 from requests.models import Response
-from requests.packages.urllib3.util.retry import Retry
 from requests_toolbelt import sessions
 
 from .mlol_constants import (
@@ -21,10 +20,33 @@ from .mlol_constants import (
     API_ENDPOINTS,
     DEFAULT_API_HEADERS,
     DEFAULT_WEB_HEADERS,
-    LIBRARY_MAPPING_FNAME,
+    DEFAULT_HTML_PARSER,
+    FULFILLMENT_TOKEN_PREFIX,
+    LATEST_BOOKS_FILTER,
+    LOAN_IDS_TTL,
+    RESOURCE_TYPES,
 )
+from .mlol_cache import MLOLBookCache
+from .mlol_library_mapping import MLOLLibraryMapping, _get_default_library_mapping
+from .mlol_policies import (
+    MLOLDeadlineExceeded,
+    MLOLPolicyAdapter,
+    _in_context,
+    deadline as _deadline,
+)
+from .mlol_ratelimit import MLOLRateLimitedAdapter, MLOLRateLimiter
+from .mlol_session_store import MLOLSessionStore
 from .mlol_types import MLOLBook, MLOLLoan, MLOLReservation, MLOLUser
-from .mlol_parsers import _parse_search_page, _parse_book_page, _parse_reservation
+from .mlol_parsers import (
+    _check_book_fields,
+    _check_html_parser,
+    _get_book_page_strainer,
+    _make_soup,
+    _normalize_isbn,
+    _parse_search_page,
+    _parse_book_page,
+    _parse_reservation,
+)
 
 
 class MLOLApiConverter:
@@ -97,6 +119,7 @@ class MLOLClient:
     library_id = None
     session = None
     api_token = None
+    username = None
 
     def __init__(
         self,
@@ -105,7 +128,30 @@ class MLOLClient:
         username: str = None,
         password: str = None,
         library_id: str = None,
+        cache: MLOLBookCache = None,
+        parser: str = DEFAULT_HTML_PARSER,
+        max_threads: int = None,
+        lazy_books: bool = False,
+        rate_limiter: MLOLRateLimiter = None,
+        session_store: MLOLSessionStore = None,
+        library_mapping: MLOLLibraryMapping = None,
+        web_adapter: HTTPAdapter = None,
+        api_adapter: HTTPAdapter = None,
     ):
+        if max_threads:
+            self.max_threads = max_threads
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.session_store = session_store
+        self.library_mapping = library_mapping or _get_default_library_mapping()
+        self._auth_lock = threading.Lock()
+        self._auth_local = threading.local()
+        # book ID -> loan ID of owned books, see _get_loan_id
+        self._loan_ids: Dict[str, str] = {}
+        self._loan_ids_time = None
+        self._loan_ids_lock = threading.Lock()
+        self.lazy_books = lazy_books
+        self.parser = _check_html_parser(parser)
         self.session = sessions.BaseUrlSession(base_url="https://medialibrary.it")
         self.session.headers.update(DEFAULT_WEB_HEADERS)
         if domain:
@@ -114,8 +160,27 @@ class MLOLClient:
                 r"https?(://)", "", domain.rstrip("/")
             )
 
+        # size connection pools for concurrent deep fetches, adapters can also
+        # be shared by clients of the same domain (see MLOLClientPool)
+        adapter = web_adapter or self._make_adapter()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        assert_status_hook = (
+            lambda response, *args, **kwargs: response.raise_for_status()
+        )
+        self.session.hooks["response"] = [
+            self._session_expired_hook,
+            assert_status_hook,
+        ]
+
+        self.api_session = requests.Session()
+        self.api_session.headers.update(DEFAULT_API_HEADERS)
+        self.api_session.mount("https://", api_adapter or self._make_adapter())
+
         if username and password and domain:
             self.username = username
+            # kept to log in again when the session expires
+            self._password = password
             if library_id:
                 if isinstance(library_id, int):
                     library_id = str(library_id)
@@ -123,33 +188,39 @@ class MLOLClient:
             elif saved_library_id := self._get_saved_library_id():
                 self.library_id = saved_library_id
 
-            self._authenticate(
-                username=username,
-                password=password,
-                library_id=library_id if library_id else saved_library_id,
-            )
-
-        adapter = HTTPAdapter(
-            max_retries=Retry(
-                total=3,
-                backoff_factor=1,
-                status_forcelist=[404, 429, 500, 502, 503, 504],
-                allowed_methods=["HEAD", "GET", "OPTIONS"],
-            )
-        )
-        self.session.mount("https://", adapter)
-        self.session.mount("http://", adapter)
-        assert_status_hook = (
-            lambda response, *args, **kwargs: response.raise_for_status()
-        )
-        self.session.hooks["response"] = [assert_status_hook]
+            if not self._restore_session():
+                self._authenticate(
+                    username=username,
+                    password=password,
+                    library_id=library_id if library_id else saved_library_id,
+                )
 
     def __repr__(self):
         values = {k: v for k, v in self.__dict__.items()}
         values["password"] = "***"
+        if "_password" in values:
+            values["_password"] = "***"
         return f"<mlol_client.MLOLClient: {values}"
 
-    def _login_web(self, *, username: str, password: str, library_id: str):
+    def _make_adapter(self) -> HTTPAdapter:
+        # timeouts and retries depend on the endpoint, see ENDPOINT_POLICIES
+        pool_maxsize = max(self.max_threads, DEFAULT_POOLSIZE)
+        if self.rate_limiter is not None:
+            return MLOLRateLimitedAdapter(self.rate_limiter, pool_maxsize=pool_maxsize)
+        return MLOLPolicyAdapter(pool_maxsize=pool_maxsize)
+
+    def _soup(self, markup: str):
+        return _make_soup(markup, self.parser)
+
+    def _login_web(
+        self,
+        *,
+        username: str,
+        password: str,
+        library_id: str,
+        session: requests.Session = None,
+    ):
+        session = session or self.session
         headers = {
             **self.session.headers,
             **{
@@ -159,7 +230,7 @@ class MLOLClient:
             },
         }
         data = {"lusername": username, "lpassword": password, "lente": library_id}
-        response = self.session.request(
+        response = session.request(
             "POST",
             url=WEB_ENDPOINTS["login"],
             headers=headers,
@@ -171,73 +242,96 @@ class MLOLClient:
 
         return False
 
-    def _get_saved_library_id(self) -> Optional[str]:
-        if (
-            not os.path.isfile(LIBRARY_MAPPING_FNAME)
-            or os.stat(LIBRARY_MAPPING_FNAME).st_size == 0
-        ):
+    def _make_login_session(self) -> sessions.BaseUrlSession:
+        # own cookies, shared connection pool
+        session = sessions.BaseUrlSession(base_url=self.session.base_url)
+        session.headers.update(DEFAULT_WEB_HEADERS)
+        adapter = self.session.get_adapter(self.session.base_url)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _get_library_id_hints(self) -> List[str]:
+        # library IDs that worked for other users of the same domain, most common first
+        ids = [
+            v
+            for k, v in self.library_mapping.to_dict().items()
+            if k.endswith(f"@{self.domain}") and v
+        ]
+        return sorted(set(ids), key=lambda i: (-ids.count(i), ids.index(i)))
+
+    def _discover_library_id(
+        self, *, username: str, password: str, library_ids: List[str]
+    ) -> Optional[str]:
+        if not library_ids:
             return
 
-        with open(LIBRARY_MAPPING_FNAME, "r", encoding="utf8") as f:
+        hints = self._get_library_id_hints()
+        library_ids = sorted(
+            library_ids, key=lambda i: hints.index(i) if i in hints else len(hints)
+        )
+
+        def try_login(library_id):
+            session = self._make_login_session()
             try:
-                data = json.load(f)
-            except:
-                logging.warning("Couldn't read library mapping file.")
-                return
+                if self._login_web(
+                    username=username,
+                    password=password,
+                    library_id=library_id,
+                    session=session,
+                ):
+                    return session
+            except Exception as e:
+                logging.debug(f"Login with library ID {library_id} failed: {e}")
+
+        executor = ThreadPoolExecutor(
+            max_workers=min(len(library_ids), self.max_threads)
+        )
+        futures = {
+            executor.submit(_in_context(try_login), l_id): l_id for l_id in library_ids
+        }
+        try:
+            for future in as_completed(futures):
+                if session := future.result():
+                    self.session.cookies.update(session.cookies)
+                    return futures[future]
+        finally:
+            # attempts still running are left to finish on their own
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
 
+    def _get_saved_library_id(self) -> Optional[str]:
         k = f"{self.username}@{self.domain}"
-        if k in data and data[k]:
+        if library_id := self.library_mapping.get(k):
             logging.debug(f"Found library ID for {k} in mapping file.")
-            return data[k]
+            return library_id
 
     def _update_library_mapping(self, library_id):
-        if os.path.isfile(LIBRARY_MAPPING_FNAME):
-            with open(LIBRARY_MAPPING_FNAME, "r", encoding="utf8") as f:
-                try:
-                    data = json.load(f)
-                except:
-                    if os.stat(LIBRARY_MAPPING_FNAME).st_size != 0:
-                        logging.warning(
-                            "Couldn't read library mapping file. Backing up and overwriting..."
-                        )
-                        copy(
-                            LIBRARY_MAPPING_FNAME,
-                            f"{LIBRARY_MAPPING_FNAME}_{int(time.time())}.bak",
-                        )
-                    data = {}
-        else:
-            data = {}
-
-        k = f"{self.username}@{self.domain}"
-        data[k] = library_id
-
-        with open(LIBRARY_MAPPING_FNAME, "w", encoding="utf8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-
+        self.library_mapping.set(f"{self.username}@{self.domain}", library_id)
         return True
 
     def _authenticate(
         self, username: str, password: str, library_id: str
     ) -> Optional[bool]:
-
         if not library_id:
             response = self.session.request("GET", url=WEB_ENDPOINTS["index"])
-            soup = BeautifulSoup(response.text, "html.parser")
+            soup = self._soup(response.text)
             # get all "lente" values for subdomain, try all
             if library_id_els := soup.select("#lente > option"):
                 library_id_values = [
                     o.attrs["value"] for o in library_id_els if "value" in o.attrs
                 ]
-                for l_id in library_id_values:
-                    if self._login_web(
-                        username=username, password=password, library_id=l_id
-                    ):
-                        logging.debug(
-                            f"Found library ID for username {username} on {self.domain}: {l_id}"
-                        )
-                        self.library_id = l_id
-                        self._update_library_mapping(l_id)
-                        break
+                if l_id := self._discover_library_id(
+                    username=username,
+                    password=password,
+                    library_ids=library_id_values,
+                ):
+                    logging.debug(
+                        f"Found library ID for username {username} on {self.domain}: {l_id}"
+                    )
+                    self.library_id = l_id
+                    self._update_library_mapping(l_id)
 
             if not self.library_id:
                 logging.error(
@@ -261,8 +355,92 @@ class MLOLClient:
             logging.error("Failed to retrieve your API token.")
             return
 
+        self._save_session()
+        return True
+
+    @property
+    def _session_key(self) -> str:
+        return f"{self.username}@{self.domain}"
+
+    def _restore_session(self) -> bool:
+        # no requests here: an expired session is detected on first use
+        if self.session_store is None or not (
+            entry := self.session_store.get(self._session_key)
+        ):
+            return False
+
+        for cookie in entry["cookies"]:
+            self.session.cookies.set(**cookie)
+        self.api_token = entry["api_token"]
+        if not self.library_id:
+            self.library_id = entry.get("library_id")
+        logging.debug(f"Restored session for {self._session_key}")
         return True
 
+    def _save_session(self) -> None:
+        if self.session_store is None:
+            return
+
+        self.session_store.set(
+            self._session_key,
+            {
+                "cookies": [
+                    {
+                        "name": c.name,
+                        "value": c.value,
+                        "domain": c.domain,
+                        "path": c.path,
+                    }
+                    for c in self.session.cookies
+                ],
+                "api_token": self.api_token,
+                "library_id": self.library_id,
+            },
+        )
+
+    def _reauthenticate(self, *, web_cookie: str = None, api_token: str = None) -> bool:
+        # web_cookie/api_token are the expired credentials, if they are not
+        # current anymore another thread already logged in again
+        with self._auth_lock:
+            if api_token is not None and api_token != self.api_token:
+                return True
+            auth_cookie = self.session.cookies.get(".ASPXAUTH")
+            if web_cookie is not None and auth_cookie and auth_cookie not in web_cookie:
+                return True
+            if not getattr(self, "_password", None):
+                return False
+
+            logging.info(f"Session expired for {self._session_key}, logging in again")
+            if self.session_store is not None:
+                self.session_store.delete(self._session_key)
+            self.session.cookies.clear()
+            self.api_token = None
+            self._auth_local.active = True
+            try:
+                return bool(
+                    self._authenticate(self.username, self._password, self.library_id)
+                )
+            finally:
+                self._auth_local.active = False
+
+    def _session_expired_hook(self, response: Response, *args, **kwargs):
+        # expired web sessions are redirected to the login form
+        location = response.headers.get("Location", "") or response.url
+        web_cookie = response.request.headers.get("Cookie", "")
+        if (
+            "logform.aspx" not in location.lower()
+            or ".ASPXAUTH" not in web_cookie
+            or getattr(self._auth_local, "active", False)
+            or not self._reauthenticate(web_cookie=web_cookie)
+        ):
+            return response
+
+        request = response.request.copy()
+        request.headers.pop("Cookie", None)
+        request.prepare_cookies(self.session.cookies)
+        # the original send() follows redirects, if it should
+        return self.session.send(request, allow_redirects=False, **kwargs)
+
     def _get_api_token(self, username: str, password: str, library_id: str) -> str:
         data = self._api_request(
             method="POST",
@@ -278,19 +456,20 @@ class MLOLClient:
         return data["token"] if data and "token" in data else None
 
     def _api_request(self, **kwargs) -> Optional[dict]:
-        if self.api_token:
+        if api_token := self.api_token:
             if "params" in kwargs:
-                kwargs["params"].update({"token": self.api_token})
+                kwargs["params"].update({"token": api_token})
             else:
-                kwargs["params"] = {"token": self.api_token}
+                kwargs["params"] = {"token": api_token}
 
-        kwargs["headers"] = (
-            dict(DEFAULT_API_HEADERS, **kwargs["headers"])
-            if "headers" in kwargs
-            else DEFAULT_API_HEADERS
-        )
-
-        response = requests.request(**kwargs)
+        response = self.api_session.request(**kwargs)
+        if (
+            response.status_code in (401, 403)
+            and api_token
+            and self._reauthenticate(api_token=api_token)
+        ):
+            kwargs["params"]["token"] = self.api_token
+            response = self.api_session.request(**kwargs)
         response.raise_for_status()
         if "application/json" in response.headers["Content-Type"]:
             return response.json()
@@ -312,9 +491,10 @@ class MLOLClient:
         logging.error(f"Failed to get queue position for reservation #{reservation_id}")
         return
 
-    def _redownload_owned_book(self, book_id: str) -> Response:
-        active_loans = self.get_resources()["active_loans"]
-        if loan_id := next((l.id for l in active_loans if l.book.id == book_id), None):
+    def _redownload_owned_book(
+        self, book_id: str, loan_id: str = None
+    ) -> Optional[Response]:
+        if loan_id := loan_id or self._get_loan_id(book_id):
             response = self.session.request(
                 "GET",
                 url=WEB_ENDPOINTS["redownload"],
@@ -331,7 +511,51 @@ class MLOLClient:
             return response
 
         logging.error(f"Failed to find owned book {book_id} in your profile")
-        raise
+        return
+
+    def _get_search_page(self, *, req_params: dict, page: int) -> Response:
+        return self.session.request(
+            method="GET",
+            url=WEB_ENDPOINTS["search"],
+            params={**req_params, **{"page": page}},
+        )
+
+    def _get_search_responses(
+        self,
+        *,
+        req_params: dict,
+        pages: int,
+        first_response: Response,
+        prefetch: int = 0,
+    ) -> Generator[Response, None, None]:
+        # the first page is always already available from the initial request
+        yield first_response
+        if pages < 2:
+            return
+
+        if prefetch < 1:
+            for i in range(2, pages + 1):
+                yield self._get_search_page(req_params=req_params, page=i)
+            return
+
+        # fetch up to `prefetch` pages ahead in parallel, yield them in order
+        get_page = _in_context(self._get_search_page)
+        executor = ThreadPoolExecutor(max_workers=min(prefetch, pages - 1))
+        futures = deque()
+        next_page = 2
+        try:
+            while futures or next_page <= pages:
+                while next_page <= pages and len(futures) < prefetch:
+                    futures.append(
+                        executor.submit(get_page, req_params=req_params, page=next_page)
+                    )
+                    next_page += 1
+                yield futures.popleft().result()
+        finally:
+            # generator closed early (or failed): drop pages nobody will read
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
 
     def _search_books_paginated(
         self,
@@ -339,43 +563,179 @@ class MLOLClient:
         req_params: dict,
         pages: int,
         deep: bool = False,
+        fields: Iterable[str] = None,
         first_response: Response = None,
+        prefetch: int = 0,
+        deadline: float = None,
     ) -> Generator[List[MLOLBook], None, None]:
-        for i in range(1, pages + 1):
-            response = (
-                first_response
-                if pages == 1
-                else self.session.request(
-                    method="GET",
-                    url=WEB_ENDPOINTS["search"],
-                    params={**req_params, **{"page": i}},
-                )
-            )
-            books = _parse_search_page(BeautifulSoup(response.text, "html.parser"))
-            if deep:
-                with ThreadPoolExecutor(
-                    max_workers=min(len(books), self.max_threads)
-                ) as executor:
-                    yield list(executor.map(self.get_book_by_id, (b.id for b in books)))
-            else:
+        responses = self._get_search_responses(
+            req_params=req_params,
+            pages=pages,
+            first_response=first_response,
+            prefetch=prefetch,
+        )
+        try:
+            while True:
+                # the deadline applies to each page and its book details.
+                # Prefetched pages are fetched in the background, outside of it
+                if prefetch > 0:
+                    response = next(responses, None)
+                with _deadline(deadline):
+                    if prefetch < 1:
+                        response = next(responses, None)
+                    if response is None:
+                        return
+
+                    books = _parse_search_page(self._soup(response.text))
+                    if deep and books:
+                        # worker threads get the deadline from this context
+                        get_book = _in_context(
+                            partial(self.get_book_by_id, fields=fields)
+                        )
+                        with ThreadPoolExecutor(
+                            max_workers=min(len(books), self.max_threads)
+                        ) as executor:
+                            books = list(executor.map(get_book, (b.id for b in books)))
+                    else:
+                        books = self._bind_books(books)
                 yield books
+        finally:
+            responses.close()
+
+    def _search_books_stream(
+        self,
+        *,
+        req_params: dict,
+        pages: int,
+        deep: bool = False,
+        fields: Iterable[str] = None,
+        first_response: Response = None,
+        ordered: bool = True,
+    ) -> Generator[MLOLBook, None, None]:
+        if not deep:
+            pages_generator = self._search_books_paginated(
+                req_params=req_params, pages=pages, first_response=first_response
+            )
+            try:
+                for books in pages_generator:
+                    yield from books
+            finally:
+                pages_generator.close()
+            return
+
+        get_book = _in_context(partial(self.get_book_by_id, fields=fields))
+        get_page = _in_context(self._get_search_page)
+        # a single pool serves both listing pages and book details, so detail
+        # fetches span page boundaries and the next page is requested early
+        executor = ThreadPoolExecutor(max_workers=self.max_threads)
+        window = self.max_threads * 2
+        queued_books = deque(_parse_search_page(self._soup(first_response.text)))
+        pending = deque()
+        next_page = 2
+        page_future = None
+        try:
+            while True:
+                if page_future is None and next_page <= pages:
+                    page_future = executor.submit(
+                        get_page, req_params=req_params, page=next_page
+                    )
+                    next_page += 1
+
+                while len(pending) < window and (queued_books or page_future):
+                    if not queued_books:
+                        response = page_future.result()
+                        page_future = None
+                        if next_page <= pages:
+                            page_future = executor.submit(
+                                get_page,
+                                req_params=req_params,
+                                page=next_page,
+                            )
+                            next_page += 1
+                        queued_books.extend(
+                            _parse_search_page(self._soup(response.text))
+                        )
+                        continue
+
+                    pending.append(executor.submit(get_book, queued_books.popleft().id))
+
+                if not pending:
+                    break
+
+                if ordered:
+                    future = pending.popleft()
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    future = done.pop()
+                    pending.remove(future)
+
+                if book := future.result():
+                    yield book
+        finally:
+            for future in pending:
+                future.cancel()
+            if page_future:
+                page_future.cancel()
+            executor.shutdown(wait=False)
 
     def _get_reservations(self) -> List[MLOLReservation]:
         reservations = []
         response = self.session.request("GET", WEB_ENDPOINTS["resources"])
-        soup = BeautifulSoup(response.text, "html.parser")
+        soup = self._soup(response.text)
 
         if reservations_el := soup.select_one("#mlolreservation"):
             for i, reservation_el in enumerate(
                 reservations_el.select("div.bottom-buffer")
             ):
-                reservation = _parse_reservation(reservation_el, index=i)
-                reservation.queue_position = self._get_queue_position(reservation.id)
-                reservations.append(reservation)
-
-        return [r for r in reservations if r is not None]
+                if reservation := _parse_reservation(reservation_el, index=i):
+                    # fetched from QueuePos.aspx only when needed
+                    reservation._queue_position_loader = partial(
+                        self._get_queue_position, reservation.id
+                    )
+                    reservations.append(reservation)
+
+        return reservations
+
+    def resolve_queue_positions(
+        self, reservations: List[MLOLReservation]
+    ) -> List[MLOLReservation]:
+        pending = [r for r in reservations if not r.queue_position_loaded]
+        if pending:
+            with ThreadPoolExecutor(
+                max_workers=min(len(pending), self.max_threads)
+            ) as executor:
+                queue_positions = executor.map(
+                    _in_context(self._get_queue_position), (r.id for r in pending)
+                )
+                for reservation, queue_position in zip(pending, queue_positions):
+                    reservation.queue_position = queue_position
+
+        return reservations
+
+    @property
+    def _cache_domain(self) -> str:
+        return re.sub(r"https?(://)", "", self.session.base_url)
+
+    def _invalidate_book_status(self, book_id: str) -> None:
+        # for every account: a new loan or reservation changes other statuses too
+        if self.cache is not None:
+            self.cache.invalidate(self._cache_domain, book_id, status_only=True)
+
+    def get_book_by_id(
+        self, book_id: str, *, fields: Iterable[str] = None
+    ) -> Optional[MLOLBook]:
+        fields = _check_book_fields(fields)
+        if self.cache is not None and (
+            book := self.cache.get(
+                self._cache_domain,
+                book_id,
+                with_status=fields is None or "status" in fields,
+                account=self.username,
+            )
+        ):
+            logging.debug(f"Found book {book_id} in cache")
+            return book
 
-    def get_book_by_id(self, book_id: str) -> Optional[MLOLBook]:
         logging.debug(f"Fetching book {book_id}")
         response = self.session.request(
             "GET",
@@ -387,13 +747,15 @@ class MLOLClient:
                 f"Failed to fetch book {book_id}. Might not be available to your library."
             )
             return None
-        soup = BeautifulSoup(response.text, "html.parser")
-        book_data = _parse_book_page(soup)
+        soup = _make_soup(
+            response.text, self.parser, parse_only=_get_book_page_strainer(fields)
+        )
+        book_data = _parse_book_page(soup, fields)
         if book_data["title"] is None:
             logging.warning(f"Failed to get book title for id {book_id}, skipping...")
             return None
 
-        return MLOLBook(
+        book = MLOLBook(
             id=book_id,
             title=book_data["title"],
             authors=book_data["authors"],
@@ -407,23 +769,76 @@ class MLOLClient:
             formats=book_data["formats"],
             drm=book_data["drm"],
         )
+        # only complete books are cached
+        if self.cache is not None and fields is None:
+            self.cache.set(self._cache_domain, book, account=self.username)
+        elif fields is not None:
+            self._bind_books([book], loaded_fields=fields)
+
+        return book
+
+    def _bind_books(
+        self, books: List[MLOLBook], *, loaded_fields: frozenset = frozenset()
+    ) -> List[MLOLBook]:
+        # bound books fetch their missing details on first access
+        if self.lazy_books:
+            for book in books:
+                book._bind(self, loaded_fields)
+
+        return books
 
-    def get_book(self, book: MLOLBook) -> Optional[MLOLBook]:
+    def hydrate(
+        self,
+        books: Iterable[MLOLBook],
+        *,
+        fields: Iterable[str] = None,
+        errors: Dict[str, Exception] = None,
+    ) -> List[MLOLBook]:
+        # Books that fail to fetch stay bound, so they are fetched again on
+        # next access. The others are updated anyway, then the first failure
+        # is raised, unless errors is given to collect failures by book ID
+        fields = _check_book_fields(fields)
+        books = list(books)
+        pending = [b for b in books if not b._is_loaded(fields)]
+        failures = {}
+        details = self._get_books_by_id(
+            (b.id for b in pending), fields=fields, errors=failures
+        )
+        for book in pending:
+            if book.id in failures:
+                continue
+            if detail := details.get(book.id):
+                book._update_details(detail, fields)
+            else:
+                # don't retry missing books on every attribute access
+                book._unbind()
+
+        if errors is not None:
+            errors.update(failures)
+        elif failures:
+            raise next(iter(failures.values()))
+        return books
+
+    def get_book(
+        self, book: MLOLBook, *, fields: Iterable[str] = None
+    ) -> Optional[MLOLBook]:
         if not isinstance(book, MLOLBook):
             raise ValueError(f"Expected MLOLBook, got {type(book)}")
 
-        return self.get_book_by_id(book.id)
+        return self.get_book_by_id(book.id, fields=fields)
 
-    def download_book_by_id(
-        self, book_id: str, download_format: str = "epub"
-    ) -> Optional[bytes]:
+    def _get_download_response(
+        self, book_id: str, book: MLOLBook = None, loan_id: str = None
+    ) -> Optional[Response]:
         if not self.is_logged_in():
             logging.error(
                 "You need to be authenticated to MLOL in order to download books."
             )
             return
 
-        book = self.get_book_by_id(book_id)
+        # books with DRM and status already parsed don't need another request
+        if book is None or book._get("drm") is None or book._get("status") is None:
+            book = self.get_book_by_id(book_id)
         if book.drm != "adobe":
             logging.error(
                 "Your book has {} DRM. Only Adobe DRM downloads are supported as of now.".format(
@@ -433,7 +848,9 @@ class MLOLClient:
             return
         if book.status == "owned":
             logging.info("You already own this book. Redownloading...")
-            response = self._redownload_owned_book(book_id)
+            response = self._redownload_owned_book(book_id, loan_id)
+            if response is None:
+                return
         elif book.status != "available":
             logging.error(f"Book is not available for download. Status: {book.status}")
             return
@@ -457,27 +874,106 @@ class MLOLClient:
                 },
                 params={"unid": book_id, "form": download_format},
                 allow_redirects=False,
+                stream=True,
             )
 
         if response.status_code == 302:
+            response.close()
             response = self.session.request(
                 "GET",
                 url=response.headers["Location"],
                 headers={**self.session.headers, **{"Sec-Fetch-Site": "cross-site"}},
+                stream=True,
             )
 
-        if response.text.startswith("<fulfillmentToken"):
-            logging.info(f"Book {book_id} downloaded")
-            return response.content
-        else:
+        return response
+
+    def iter_book_download_by_id(
+        self,
+        book_id: str,
+        *,
+        book: MLOLBook = None,
+        loan_id: str = None,
+        chunk_size: int = 64 * 1024,
+    ) -> Optional[Generator[bytes, None, None]]:
+        # None if the download fails, otherwise a generator of chunks of the
+        # file. Only the beginning of the response is read to check it.
+        # loan_id saves looking up the loan of owned books
+        response = self._get_download_response(str(book_id), book, loan_id)
+        if response is None:
+            return
+
+        chunks = response.iter_content(chunk_size)
+        head = b""
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= len(FULFILLMENT_TOKEN_PREFIX):
+                break
+        if not head.startswith(FULFILLMENT_TOKEN_PREFIX):
+            response.close()
             logging.error(f"Failed to download book {book_id}")
-            return None
+            return
+
+        self._invalidate_book_status(book_id)
+
+        def stream():
+            try:
+                yield head
+                yield from chunks
+                logging.info(f"Book {book_id} downloaded")
+            finally:
+                response.close()
+
+        return stream()
+
+    def iter_book_download(
+        self, book: MLOLBook, *, chunk_size: int = 64 * 1024
+    ) -> Optional[Generator[bytes, None, None]]:
+        if not isinstance(book, MLOLBook):
+            raise ValueError(f"Expected MLOLBook, got {type(book)}")
+
+        return self.iter_book_download_by_id(book.id, book=book, chunk_size=chunk_size)
+
+    def download_book_to(
+        self,
+        book: Union[MLOLBook, str],
+        destination: Union[str, BinaryIO],
+        *,
+        loan_id: str = None,
+    ) -> Optional[int]:
+        # writes the .acsm file to a path or binary file object, returns its size
+        if isinstance(book, MLOLBook):
+            chunks = self.iter_book_download_by_id(book.id, book=book, loan_id=loan_id)
+        else:
+            chunks = self.iter_book_download_by_id(book, loan_id=loan_id)
+        if chunks is None:
+            return
+
+        if not isinstance(destination, (str, os.PathLike)):
+            return sum(destination.write(chunk) for chunk in chunks)
+
+        # no partial files if the download is interrupted
+        tmp_path = f"{destination}.part"
+        try:
+            with open(tmp_path, "wb") as f:
+                size = sum(f.write(chunk) for chunk in chunks)
+            os.replace(tmp_path, destination)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return size
+
+    def download_book_by_id(
+        self, book_id: str, download_format: str = "epub", *, book: MLOLBook = None
+    ) -> Optional[bytes]:
+        if (chunks := self.iter_book_download_by_id(book_id, book=book)) is not None:
+            return b"".join(chunks)
 
     def download_book(self, book: MLOLBook) -> Optional[bytes]:
         if not isinstance(book, MLOLBook):
             raise ValueError(f"Expected MLOLBook, got {type(book)}")
 
-        return self.download_book_by_id(book.id)
+        return self.download_book_by_id(book.id, book=book)
 
     def get_book_url_by_id(self, book_id: str) -> str:
         return f"{self.session.base_url}{WEB_ENDPOINTS['get_book']}?id={book_id}"
@@ -513,10 +1009,11 @@ class MLOLClient:
             url=f"{WEB_ENDPOINTS['reserve']}?id={book_id}&email={email}",
             headers=headers,
         )
-        soup = BeautifulSoup(response.text, "html.parser")
+        soup = self._soup(response.text)
         if outcome := soup.select_one("#lblInfo"):
             message = outcome.text.strip().lower()
             if "con successo" in message:
+                self._invalidate_book_status(book_id)
                 return True
             elif "prenotazione attiva" in message:
                 logging.warning(
@@ -587,48 +1084,155 @@ class MLOLClient:
 
         for reservation in self._get_reservations():
             if reservation.book.id == book.id:
-                return self.cancel_reservation_by_id(reservation.id)
+                if outcome := self.cancel_reservation_by_id(reservation.id):
+                    self._invalidate_book_status(book.id)
+                return outcome
 
         logging.error(
             f"Could not cancel reservation for book #{book.id} (reservation ID not found)"
         )
         return
 
-    def get_resources(self, *, deep=False) -> dict:
-        resources = {}
-        resources["reservations"] = self._get_reservations()
-
+    def _get_active_loans(self) -> Optional[List[MLOLLoan]]:
         if (
             loan_response := self._api_request(method="GET", url=API_ENDPOINTS["loans"])
         ) and "loans" in loan_response:
-            resources["active_loans"] = [
-                MLOLApiConverter.get_loan(l) for l in loan_response["loans"]
-            ]
+            loans = [MLOLApiConverter.get_loan(l) for l in loan_response["loans"]]
+            with self._loan_ids_lock:
+                self._loan_ids = {l.book.id: l.id for l in loans if l and l.id}
+                self._loan_ids_time = time.monotonic()
+            return loans
+
+    def _get_loan_id(self, book_id: str) -> Optional[str]:
+        # loans only change when books are borrowed or returned, so the last
+        # list of active loans is good enough for a little while
+        with self._loan_ids_lock:
+            if (
+                self._loan_ids_time is not None
+                and time.monotonic() - self._loan_ids_time <= LOAN_IDS_TTL
+                and (loan_id := self._loan_ids.get(book_id))
+            ):
+                return loan_id
+
+        # missing books may have been borrowed since
+        self._get_active_loans()
+        with self._loan_ids_lock:
+            return self._loan_ids.get(book_id)
 
+    def _get_loan_history(self) -> Optional[List[MLOLLoan]]:
         if (
             loan_history_response := self._api_request(
                 method="GET", url=API_ENDPOINTS["loan_history"]
             )
         ) and "loans" in loan_history_response:
-            resources["loan_history"] = [
+            return [
                 MLOLApiConverter.get_loan(l) for l in loan_history_response["loans"]
             ]
 
+    def _get_books_by_id(
+        self,
+        book_ids: Iterable[str],
+        *,
+        fields: Iterable[str] = None,
+        errors: Dict[str, Exception] = None,
+    ) -> dict:
+        # fetch each distinct book once, in parallel. With errors, failed
+        # fetches are collected there by book ID and left out of the result
+        # instead of raising; running out of deadline still raises
+        book_ids = list(dict.fromkeys(book_ids))
+        if not book_ids:
+            return {}
+
+        books = {}
+        with ThreadPoolExecutor(
+            max_workers=min(len(book_ids), self.max_threads)
+        ) as executor:
+            get_book = _in_context(partial(self.get_book_by_id, fields=fields))
+            futures = {
+                book_id: executor.submit(get_book, book_id) for book_id in book_ids
+            }
+            for book_id, future in futures.items():
+                try:
+                    books[book_id] = future.result()
+                except MLOLDeadlineExceeded:
+                    raise
+                except Exception as e:
+                    if errors is None:
+                        raise
+                    errors[book_id] = e
+
+        return books
+
+    def get_resources(
+        self, *, deep=False, include: Iterable[str] = None, deadline: float = None
+    ) -> dict:
+        # include: some of RESOURCE_TYPES, all of them by default.
+        # With a deadline (seconds), raises MLOLDeadlineExceeded when it runs out
+        include = frozenset(RESOURCE_TYPES if include is None else include)
+        if unknown := include - set(RESOURCE_TYPES):
+            raise ValueError(
+                f"Unknown resources: {', '.join(sorted(unknown))}. "
+                f"Supported resources: {', '.join(RESOURCE_TYPES)}"
+            )
+
+        with _deadline(deadline):
+            return self._get_resources(deep=deep, include=include)
+
+    def _get_resources(
+        self, *, deep=False, include: Iterable[str] = RESOURCE_TYPES
+    ) -> dict:
+        getters = {
+            "reservations": self._get_reservations,
+            "active_loans": self._get_active_loans,
+            "loan_history": self._get_loan_history,
+        }
+        if not include:
+            return {}
+
+        with ThreadPoolExecutor(max_workers=len(include)) as executor:
+            futures = {
+                k: executor.submit(_in_context(getters[k]))
+                for k in RESOURCE_TYPES
+                if k in include
+            }
+            resources = {
+                k: result
+                for k, future in futures.items()
+                if (result := future.result()) is not None
+            }
+
         if deep:
-            for reservation in resources["reservations"]:
-                if book := self.get_book_by_id(reservation.book.id):
-                    reservation.book = book
-            for loan in resources["active_loans"]:
-                if book := self.get_book_by_id(loan.book.id):
-                    loan.book = book
-            for loan in resources["loan_history"]:
-                if book := self.get_book_by_id(loan.book.id):
-                    loan.book = book
+            # the same book can show up in reservations, loans and history
+            items = [item for v in resources.values() for item in v if item]
+            books = self._get_books_by_id(item.book.id for item in items)
+            for item in items:
+                if book := books[item.book.id]:
+                    item.book = book
 
         return resources
 
+    def _get_first_search_page(self, params: dict) -> Tuple[Response, int]:
+        response = self.session.request(
+            "GET", url=WEB_ENDPOINTS["search"], params=params
+        )
+        soup = self._soup(response.text)
+
+        try:
+            pages = int(soup.select_one("#pager").attrs["data-pages"])
+        except AttributeError:
+            pages = 1
+
+        return response, pages
+
     def search_books(
-        self, query: str, *, deep: bool = False, only_available: bool = False
+        self,
+        query: str,
+        *,
+        deep: bool = False,
+        fields: Iterable[str] = None,
+        only_available: bool = False,
+        prefetch: int = 0,
+        deadline: float = None,
     ) -> Generator[List[MLOLBook], None, None]:
         params = {"seltip": 310, "keywords": query.strip(), "nris": 48}
         if only_available:
@@ -637,44 +1241,126 @@ class MLOLClient:
                 return
             params.update({"chkdispo": "on"})
 
-        response = self.session.request(
-            "GET", url=WEB_ENDPOINTS["search"], params=params
+        fields = _check_book_fields(fields)
+        response, pages = self._get_first_search_page(params)
+        return self._search_books_paginated(
+            req_params=params,
+            deep=deep,
+            fields=fields,
+            pages=pages,
+            first_response=response,
+            prefetch=prefetch,
+            deadline=deadline,
         )
-        soup = BeautifulSoup(response.text, "html.parser")
 
-        try:
-            pages = int(soup.select_one("#pager").attrs["data-pages"])
-        except AttributeError:
-            pages = 1
+    def search_books_iter(
+        self,
+        query: str,
+        *,
+        deep: bool = False,
+        fields: Iterable[str] = None,
+        only_available: bool = False,
+        ordered: bool = True,
+    ) -> Generator[MLOLBook, None, None]:
+        params = {"seltip": 310, "keywords": query.strip(), "nris": 48}
+        if only_available:
+            if not self.is_logged_in():
+                logging.error("You need to be logged in to check for available books.")
+                return
+            params.update({"chkdispo": "on"})
 
-        return self._search_books_paginated(
-            req_params=params, deep=deep, pages=pages, first_response=response
+        fields = _check_book_fields(fields)
+        response, pages = self._get_first_search_page(params)
+        return self._search_books_stream(
+            req_params=params,
+            deep=deep,
+            fields=fields,
+            pages=pages,
+            first_response=response,
+            ordered=ordered,
         )
 
     def get_latest_books(
-        self, *, deep: bool = False, only_available: bool = False
+        self,
+        *,
+        deep: bool = False,
+        fields: Iterable[str] = None,
+        only_available: bool = False,
+        prefetch: int = 0,
+        deadline: float = None,
     ) -> Generator[List[MLOLBook], None, None]:
-        params = {"seltip": 310, "news": "15day", "nris": 48}
+        params = {"seltip": 310, "news": LATEST_BOOKS_FILTER, "nris": 48}
         if only_available:
             if not self.is_logged_in():
                 logging.error("You need to be logged in to check for available books.")
                 return
             params.update({"chkdispo": "on"})
 
-        response = self.session.request(
-            "GET", url=WEB_ENDPOINTS["search"], params=params
-        )
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        try:
-            pages = int(soup.select_one("#pager").attrs["data-pages"])
-        except AttributeError:
-            pages = 1
-
+        fields = _check_book_fields(fields)
+        response, pages = self._get_first_search_page(params)
         return self._search_books_paginated(
-            req_params=params, deep=deep, pages=pages, first_response=response
+            req_params=params,
+            deep=deep,
+            fields=fields,
+            pages=pages,
+            first_response=response,
+            prefetch=prefetch,
+            deadline=deadline,
         )
 
+    def _resolve_isbn(self, isbn: str) -> Optional[str]:
+        params = {"seltip": 310, "keywords": isbn, "nris": 48}
+        response, _ = self._get_first_search_page(params)
+        books = _parse_search_page(self._soup(response.text))
+        if len(books) < 2:
+            return books[0].id if books else None
+
+        # the keywords also match other fields, check ISBNs on the book pages
+        details = self._get_books_by_id((b.id for b in books), fields={"ISBNs"})
+        for book in books:
+            if (detail := details.get(book.id)) and isbn in map(
+                _normalize_isbn, detail.ISBNs or []
+            ):
+                return book.id
+
+    def resolve_isbns(
+        self, isbns: Iterable[str], *, batch_size: int = 100
+    ) -> Dict[str, Optional[str]]:
+        # ISBN -> book id, None for ISBNs the library doesn't have. ISBNs that
+        # couldn't be checked (request errors) are left out, to be retried
+        isbns = list(dict.fromkeys(isbns))
+        normalized = {isbn: _normalize_isbn(isbn) for isbn in isbns}
+        pending = list(dict.fromkeys(normalized.values()))
+        resolved = {}
+        if self.cache is not None:
+            resolved = self.cache.get_isbns(self._cache_domain, pending)
+            pending = [isbn for isbn in pending if isbn not in resolved]
+
+        resolve_isbn = _in_context(self._resolve_isbn)
+        with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
+            # cache each batch as soon as it's done, so interrupted runs keep progress
+            for i in range(0, len(pending), batch_size):
+                futures = {
+                    isbn: executor.submit(resolve_isbn, isbn)
+                    for isbn in pending[i : i + batch_size]
+                }
+                batch = {}
+                for isbn, future in futures.items():
+                    try:
+                        batch[isbn] = future.result()
+                    except Exception as e:
+                        # neither cached nor returned
+                        logging.error(f"Failed to resolve ISBN {isbn}: {e}")
+                if self.cache is not None:
+                    self.cache.set_isbns(self._cache_domain, batch)
+                resolved.update(batch)
+
+        return {
+            isbn: resolved[normalized[isbn]]
+            for isbn in isbns
+            if normalized[isbn] in resolved
+        }
+
     def get_user(self) -> Optional[MLOLUser]:
         data = self._api_request(method="GET", url=API_ENDPOINTS["userinfo"])
         if data:
@@ -2,6 +2,37 @@ import os
 
 LIBRARY_MAPPING_FNAME = os.path.join(os.path.dirname(__file__), "library_mapping.json")
 
+# BeautifulSoup tree builders, "lxml" is much faster but needs the lxml package
+DEFAULT_HTML_PARSER = "html.parser"
+HTML_PARSERS = ["html.parser", "lxml"]
+
+# book page sections (by CSS class) needed to parse each MLOLBook field
+BOOK_PAGE_SECTIONS = {
+    "title": ["book-title"],
+    "authors": ["authors_title"],
+    "publisher": ["publisher_title"],
+    "year": ["publisher_title"],
+    "status": ["panel-mlol"],
+    "description": ["description"],
+    "ISBNs": ["table"],
+    "language": ["table"],
+    "categories": ["table"],
+    "formats": ["table"],
+    "drm": ["table"],
+}
+
+# downloads are Adobe ACSM files
+FULFILLMENT_TOKEN_PREFIX = b"<fulfillmentToken"
+
+# "news" search filter used by get_latest_books, and how far back it goes
+LATEST_BOOKS_FILTER = "15day"
+LATEST_BOOKS_DAYS = 15
+
+# what get_resources can fetch, and how long (seconds) loan IDs of owned books
+# are reused for redownloads
+RESOURCE_TYPES = ("reservations", "active_loans", "loan_history")
+LOAN_IDS_TTL = 60
+
 DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.67 Safari/537.36"
 DEFAULT_WEB_HEADERS = {
     "User-Agent": DEFAULT_USER_AGENT,
@@ -27,6 +58,26 @@ WEB_ENDPOINTS = {
     "get_queue_position": "/commons/QueuePos.aspx",
 }
 
+# timeouts (connect, read), retries on idempotent requests and retried statuses,
+# by WEB_ENDPOINTS/API_ENDPOINTS name. Missing ids are 404s, so 404 is never retried
+DEFAULT_ENDPOINT_POLICY = {
+    "timeout": (5, 30),
+    "retries": 3,
+    "backoff_factor": 1,
+    "status_forcelist": [429, 500, 502, 503, 504],
+}
+ENDPOINT_POLICIES = {
+    "index": {"timeout": (5, 15)},
+    "search": {"timeout": (5, 20)},
+    "get_book": {"timeout": (5, 15)},
+    "get_queue_position": {"timeout": (5, 10), "retries": 2},
+    "download": {"timeout": (5, 60), "retries": 1},
+    "redownload": {"timeout": (5, 60), "retries": 1},
+    "loans": {"timeout": (5, 20)},
+    "loan_history": {"timeout": (5, 20)},
+    "userinfo": {"timeout": (5, 10)},
+}
+
 # taken from MLOL mobile app
 DEFAULT_API_HEADERS = {
     "Host": "api.medialibrary.it",
@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Union
+
+from .mlol_client import MLOLClient
+from .mlol_policies import _in_context
+from .mlol_types import MLOLBook
+
+# what the downloader needs to know about a book before downloading it
+DOWNLOAD_FIELDS = frozenset(["status", "drm", "formats"])
+
+
+class MLOLBulkDownloader:
+    # Downloads many books to a directory as <book id>.acsm. Finished downloads
+    # are recorded in a manifest, so that books are skipped when run again.
+    # New loans stop when the monthly quota (remaining_loans) is used up,
+    # owned books are downloaded again without using any
+
+    def __init__(
+        self,
+        client: MLOLClient,
+        directory: str,
+        *,
+        manifest_path: str = None,
+        max_workers: int = 4,
+    ):
+        self.client = client
+        self.directory = directory
+        self.manifest_path = manifest_path or os.path.join(directory, "manifest.json")
+        self.max_workers = max(1, max_workers)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<mlol_client.{type(self).__name__}: {self.directory}>"
+
+    def _read_manifest(self) -> Dict[str, dict]:
+        try:
+            with open(self.manifest_path, encoding="utf8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logging.warning(f"Couldn't read manifest {self.manifest_path}, ignoring it")
+            return {}
+
+    def _add_to_manifest(self, book_id: str, path: str) -> None:
+        with self._lock:
+            manifest = self._read_manifest()
+            manifest[book_id] = {"path": path, "time": datetime.now().isoformat()}
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.manifest_path)),
+                prefix=".manifest",
+            )
+            try:
+                with os.fdopen(fd, "w", encoding="utf8") as f:
+                    json.dump(manifest, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.manifest_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+
+    def _get_done(self) -> Dict[str, str]:
+        return {
+            book_id: entry["path"]
+            for book_id, entry in self._read_manifest().items()
+            if os.path.exists(entry["path"])
+        }
+
+    def _resolve_books(self, books: List[Union[MLOLBook, str]]) -> List[MLOLBook]:
+        # one request per book that doesn't come with the fields needed
+        pending = [
+            b
+            for b in books
+            if not isinstance(b, MLOLBook)
+            or any(b._get(f) is None for f in DOWNLOAD_FIELDS)
+        ]
+        errors = {}
+        details = self.client._get_books_by_id(
+            (_get_id(b) for b in pending), fields=DOWNLOAD_FIELDS, errors=errors
+        )
+        resolved = []
+        for book in books:
+            # a book that can't be resolved doesn't stop the others
+            if error := errors.get(_get_id(book)):
+                logging.error(f"Failed to get book {_get_id(book)}: {error}")
+                continue
+            if book in pending and (book := details.get(_get_id(book))) is None:
+                continue
+            resolved.append(book)
+        return resolved
+
+    def run(
+        self, books: Iterable[Union[MLOLBook, str]]
+    ) -> Optional[Dict[str, Optional[str]]]:
+        # book id -> path of the .acsm file, None for books not downloaded
+        if not self.client.is_logged_in():
+            logging.error(
+                "You need to be authenticated to MLOL in order to download books."
+            )
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        done = self._get_done()
+        todo = {}
+        for book in books:
+            if (book_id := _get_id(book)) not in done:
+                todo.setdefault(book_id, book)
+        results = {**done, **dict.fromkeys(todo)}
+        if not todo:
+            return results
+
+        # a single request each for the quota and the loans of owned books
+        user = self.client.get_user()
+        remaining_loans = user.remaining_loans if user else None
+        loans = self.client._get_active_loans() or []
+        loan_ids = {l.book.id: l.id for l in loans if l is not None}
+
+        downloads = []
+        for book in self._resolve_books(list(todo.values())):
+            if book.status == "owned":
+                downloads.append(book)
+            elif book.status != "available":
+                logging.error(f"Book {book.id} is not available. Status: {book.status}")
+            elif remaining_loans is not None and remaining_loans <= 0:
+                logging.warning(f"No loans left this month, skipping book {book.id}")
+            else:
+                downloads.append(book)
+                if remaining_loans is not None:
+                    remaining_loans -= 1
+        if not downloads:
+            return results
+
+        def download(book: MLOLBook) -> Optional[str]:
+            path = os.path.join(self.directory, f"{book.id}.acsm")
+            # a failed book doesn't stop the others
+            try:
+                size = self.client.download_book_to(
+                    book, path, loan_id=loan_ids.get(book.id)
+                )
+            except Exception as e:
+                logging.error(f"Download failed for book {book.id}: {e}")
+                return
+            if size:
+                self._add_to_manifest(book.id, path)
+                return path
+
+        with ThreadPoolExecutor(
+            max_workers=min(len(downloads), self.max_workers)
+        ) as executor:
+            paths = executor.map(_in_context(download), downloads)
+            results.update(zip((b.id for b in downloads), paths))
+
+        return results
+
+
+def _get_id(book: Union[MLOLBook, str]) -> str:
+    return book.id if isinstance(book, MLOLBook) else str(book)
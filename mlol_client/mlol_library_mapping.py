@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no locking between processes
+    fcntl = None
+
+from .mlol_constants import LIBRARY_MAPPING_FNAME
+
+# readable by everyone, like files created with the default umask
+DEFAULT_MAPPING_MODE = 0o644
+
+
+@contextmanager
+def _file_lock(path: str):
+    # exclusive lock between processes on path + ".lock"
+    if fcntl is None:
+        yield
+        return
+
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class MLOLLibraryMapping:
+    # username@domain -> library ID, in a JSON file that can be shared by many
+    # processes. Reads are served from memory until the file changes; updates
+    # are written to a temporary file and renamed under an exclusive lock.
+    # The location defaults to $MLOL_LIBRARY_MAPPING, then to the package directory
+
+    def __init__(self, path: str = None):
+        self.path = os.path.expanduser(
+            path or os.getenv("MLOL_LIBRARY_MAPPING") or LIBRARY_MAPPING_FNAME
+        )
+        self._lock = threading.RLock()
+        self._data = {}
+        self._version = None
+
+    def __repr__(self):
+        return f"<mlol_client.{type(self).__name__}: {self.path}>"
+
+    def _get_version(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        # a rename always changes the inode
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _read(self) -> Dict[str, str]:
+        try:
+            with open(self.path, "r", encoding="utf8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logging.warning("Couldn't read library mapping file.")
+            return {}
+
+    def _load(self) -> Dict[str, str]:
+        if (version := self._get_version()) != self._version:
+            self._data = self._read() if version is not None else {}
+            self._version = version
+        return self._data
+
+    def _get_mode(self) -> int:
+        try:
+            return stat.S_IMODE(os.stat(self.path).st_mode)
+        except FileNotFoundError:
+            return DEFAULT_MAPPING_MODE
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._load().get(key)
+
+    def to_dict(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._load())
+
+    def set(self, key: str, library_id: str) -> None:
+        with self._lock, _file_lock(self.path):
+            # other processes may have written since the last read
+            data = dict(self._load())
+            if data.get(key) == library_id:
+                return
+            data[key] = library_id
+
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.path)),
+                prefix=".library_mapping",
+            )
+            try:
+                with os.fdopen(fd, "w", encoding="utf8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                # mkstemp files are private, the mapping is shared by users
+                os.chmod(tmp_path, self._get_mode())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            self._data, self._version = data, self._get_version()
+
+
+class SQLiteLibraryMapping(MLOLLibraryMapping):
+    # same as MLOLLibraryMapping, SQLite does the locking
+
+    def __init__(self, path: str):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.RLock()
+        self._data = {}
+        self._version = None
+        self._connection = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False
+        )
+        with self._lock, self._connection:
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS library_mapping (
+                    key TEXT PRIMARY KEY,
+                    library_id TEXT NOT NULL
+                )"""
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _get_version(self):
+        # changes when another connection commits
+        return self._connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def _read(self) -> Dict[str, str]:
+        return dict(
+            self._connection.execute("SELECT key, library_id FROM library_mapping")
+        )
+
+    def set(self, key: str, library_id: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO library_mapping VALUES (?, ?)",
+                (key, library_id),
+            )
+            # our own writes don't change data_version
+            self._data = {**self._load(), key: library_id}
+
+
+_default_mappings: Dict[str, MLOLLibraryMapping] = {}
+_default_mappings_lock = threading.Lock()
+
+
+def _get_default_library_mapping() -> MLOLLibraryMapping:
+    # shared by all clients of the process, so the cached view is too
+    path = os.getenv("MLOL_LIBRARY_MAPPING") or LIBRARY_MAPPING_FNAME
+    with _default_mappings_lock:
+        if path not in _default_mappings:
+            _default_mappings[path] = MLOLLibraryMapping(path)
+        return _default_mappings[path]
@@ -2,13 +2,67 @@ import logging
 import re
 from collections import defaultdict
 from datetime import datetime
-from typing import List, Optional
+from typing import Iterable, List, Optional
 
-from bs4 import Tag
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer, Tag
 
+from .mlol_constants import BOOK_PAGE_SECTIONS, DEFAULT_HTML_PARSER, HTML_PARSERS
 from .mlol_types import MLOLBook, MLOLReservation
 
 
+def _check_html_parser(parser: str) -> str:
+    if parser not in HTML_PARSERS:
+        raise ValueError(
+            f"Unknown HTML parser {parser}. Supported parsers: {', '.join(HTML_PARSERS)}"
+        )
+    try:
+        BeautifulSoup("", parser)
+    except FeatureNotFound:
+        raise ValueError(f"HTML parser {parser} is not installed")
+
+    return parser
+
+
+def _make_soup(
+    markup: str, parser: str = DEFAULT_HTML_PARSER, *, parse_only: SoupStrainer = None
+) -> BeautifulSoup:
+    return BeautifulSoup(markup, parser, parse_only=parse_only)
+
+
+def _check_book_fields(fields: Optional[Iterable[str]]) -> Optional[frozenset]:
+    if fields is None:
+        return None
+
+    fields = frozenset(fields)
+    if unknown_fields := fields - BOOK_PAGE_SECTIONS.keys():
+        raise ValueError(
+            f"Unknown book fields: {', '.join(sorted(unknown_fields))}. "
+            f"Supported fields: {', '.join(BOOK_PAGE_SECTIONS)}"
+        )
+
+    # title is always needed to tell valid book pages apart
+    return fields | {"title"}
+
+
+def _get_book_page_strainer(fields: Optional[frozenset]) -> Optional[SoupStrainer]:
+    if fields is None:
+        return None
+
+    sections = {c for f in fields for c in BOOK_PAGE_SECTIONS[f]}
+
+    def in_sections(classes) -> bool:
+        # depending on the bs4 version, multi-valued class attributes are
+        # matched one class at a time or as the whole "a b" string
+        return classes is not None and not sections.isdisjoint(classes.split())
+
+    return SoupStrainer(class_=in_sections)
+
+
+def _normalize_isbn(isbn: str) -> str:
+    # "978-88-459-8248-4" -> "9788845982484"
+    return re.sub(r"[^0-9X]", "", isbn.upper())
+
+
 def _parse_search_page(page: Tag) -> List[MLOLBook]:
     books = []
     for i, book in enumerate(page.select(".result-item")):
@@ -76,35 +130,45 @@ def _parse_drm(drm: str) -> Optional[str]:
     return "unknown"
 
 
-def _parse_book_page(page: Tag) -> dict:
+def _parse_book_page(page: Tag, fields: Optional[frozenset] = None) -> dict:
+    # fields=None parses everything, otherwise only the given fields
     book_data = defaultdict(lambda: None)
+    wanted = (lambda field: True) if fields is None else fields.__contains__
 
-    if title := page.select_one(".book-title"):
+    if wanted("title") and (title := page.select_one(".book-title")):
         book_data["title"] = title.text.strip()
 
-    if authors := page.select_one(".authors_title"):
+    if wanted("authors") and (authors := page.select_one(".authors_title")):
         book_data["authors"] = [a.strip() for a in authors.text.strip().split(";")]
 
-    if publisher := page.select_one(".publisher_title > span > a"):
+    if wanted("publisher") and (
+        publisher := page.select_one(".publisher_title > span > a")
+    ):
         book_data["publisher"] = publisher.text.strip()
 
-    if ISBNs := page.find_all(attrs={"itemprop": "isbn"}):
+    if wanted("ISBNs") and (ISBNs := page.find_all(attrs={"itemprop": "isbn"})):
         book_data["ISBNs"] = [i.text.strip() for i in ISBNs]
 
-    if status_element := page.select_one(".panel-mlol"):
+    if wanted("status") and (status_element := page.select_one(".panel-mlol")):
         book_data["status"] = _parse_book_status(status_element.text.strip())
 
-    if (description_el := page.find("div", attrs={"itemprop": "description"})) and (
-        description := next(
-            filter(
-                lambda x: hasattr(x, "text"),
-                description_el,
+    if (
+        wanted("description")
+        and (description_el := page.find("div", attrs={"itemprop": "description"}))
+        and (
+            description := next(
+                filter(
+                    lambda x: hasattr(x, "text"),
+                    description_el,
+                )
             )
         )
     ):
         book_data["description"] = description.text.strip()
 
-    if categories := page.find("span", attrs={"itemprop": "keywords"}):
+    if wanted("categories") and (
+        categories := page.find("span", attrs={"itemprop": "keywords"})
+    ):
         book_data["categories"] = []
         for category_line in categories.text.replace("# in ", "").split("\n\n"):
             stripped_category_line = category_line.strip()
@@ -116,23 +180,32 @@ def _parse_book_page(page: Tag) -> dict:
             ]
             book_data["categories"].append(category)
 
-    if language := page.find("span", attrs={"itemprop": "inLanguage"}):
+    if wanted("language") and (
+        language := page.find("span", attrs={"itemprop": "inLanguage"})
+    ):
         book_data["language"] = language.text.strip()
 
-    if year := page.find("span", attrs={"itemprop": "datePublished"}):
+    if wanted("year") and (
+        year := page.find("span", attrs={"itemprop": "datePublished"})
+    ):
         book_data["year"] = int(year.text.strip())
 
+    if not (wanted("formats") or wanted("drm")):
+        return book_data
+
     try:
         # e.g. "EPUB/PDF con DRM Adobe"
         formats_str = (
-            page.find("b", text=re.compile("FORMATO"))
+            page.find("b", string=re.compile("FORMATO"))
             .parent.parent.find("span")
             .text.strip()
         )
-        book_data["drm"] = _parse_drm(formats_str)
-        book_data["formats"] = [
-            f.strip().lower() for f in formats_str.split()[0].split("/")
-        ]
+        if wanted("drm"):
+            book_data["drm"] = _parse_drm(formats_str)
+        if wanted("formats"):
+            book_data["formats"] = [
+                f.strip().lower() for f in formats_str.split()[0].split("/")
+            ]
     except:
         logging.warning(f"Failed to parse formats for book {book_data['title']}")
 
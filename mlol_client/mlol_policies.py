@@ -0,0 +1,124 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Callable, Optional
+from urllib.parse import urlparse
+
+from requests.adapters import HTTPAdapter
+from requests.exceptions import Timeout
+from requests.packages.urllib3.util.retry import Retry
+
+from .mlol_constants import (
+    API_ENDPOINTS,
+    DEFAULT_ENDPOINT_POLICY,
+    ENDPOINT_POLICIES,
+    WEB_ENDPOINTS,
+)
+
+# time.monotonic() by which the current operation must be done
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+_ENDPOINTS_BY_PATH = {
+    urlparse(url).path.lower(): name
+    for endpoints in (WEB_ENDPOINTS, API_ENDPOINTS)
+    for name, url in endpoints.items()
+}
+
+
+class MLOLDeadlineExceeded(Timeout, TimeoutError):
+    pass
+
+
+@contextmanager
+def deadline(seconds: Optional[float]):
+    # requests made within the block (and by client worker threads) fail with
+    # MLOLDeadlineExceeded once the time is up. Nested deadlines can only shorten it
+    if seconds is None:
+        yield
+        return
+
+    end = time.monotonic() + seconds
+    if (current := _deadline.get()) is not None:
+        end = min(end, current)
+    token = _deadline.set(end)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def _remaining_time() -> Optional[float]:
+    if (end := _deadline.get()) is None:
+        return None
+    if (remaining := end - time.monotonic()) <= 0:
+        raise MLOLDeadlineExceeded("Deadline exceeded")
+    return remaining
+
+
+def _in_context(fn: Callable) -> Callable:
+    # executor threads don't inherit context variables: run fn in a copy of
+    # the caller's context, one per call so that it can run in parallel
+    context = copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+def _get_endpoint_policy(url: str) -> dict:
+    name = _ENDPOINTS_BY_PATH.get(urlparse(url).path.lower())
+    return {**DEFAULT_ENDPOINT_POLICY, **ENDPOINT_POLICIES.get(name, {})}
+
+
+def _make_retry(policy: dict) -> Retry:
+    return Retry(
+        total=policy["retries"],
+        backoff_factor=policy["backoff_factor"],
+        status_forcelist=policy["status_forcelist"],
+        allowed_methods=["HEAD", "GET", "OPTIONS"],
+    )
+
+
+class MLOLPolicyAdapter(HTTPAdapter):
+    # applies the timeout and retry policy of the endpoint being requested
+
+    def __init__(self, **kwargs):
+        self._local = threading.local()
+        super().__init__(max_retries=_make_retry(DEFAULT_ENDPOINT_POLICY), **kwargs)
+        self._retries = {}
+
+    # HTTPAdapter.send reads self.max_retries, set per request and thread
+    @property
+    def max_retries(self) -> Retry:
+        return getattr(self._local, "max_retries", None) or self._default_retries
+
+    @max_retries.setter
+    def max_retries(self, max_retries: Retry):
+        self._default_retries = max_retries
+
+    def send(self, request, timeout=None, **kwargs):
+        policy = _get_endpoint_policy(request.url)
+        if timeout is None:
+            timeout = policy["timeout"]
+        if (remaining := _remaining_time()) is not None:
+            connect, read = timeout if isinstance(timeout, tuple) else (timeout,) * 2
+            timeout = (min(connect, remaining), min(read, remaining))
+            # no retries if the time left doesn't even cover their backoff
+            backoff = sum(
+                policy["backoff_factor"] * 2**i for i in range(policy["retries"])
+            )
+            if remaining < backoff:
+                policy = {**policy, "retries": 0}
+
+        key = (policy["retries"], policy["backoff_factor"], *policy["status_forcelist"])
+        if (retries := self._retries.get(key)) is None:
+            retries = self._retries[key] = _make_retry(policy)
+
+        self._local.max_retries = retries
+        try:
+            response = super().send(request, timeout=timeout, **kwargs)
+        except Timeout as e:
+            if _deadline.get() is not None and _deadline.get() <= time.monotonic():
+                raise MLOLDeadlineExceeded("Deadline exceeded") from e
+            raise
+        finally:
+            self._local.max_retries = None
+        return response
@@ -0,0 +1,116 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
+
+from .mlol_cache import MLOLBookCache, MemoryBookCache
+from .mlol_client import MLOLClient
+from .mlol_policies import _in_context
+from .mlol_ratelimit import MLOLRateLimitedAdapter, MLOLRateLimiter
+from .mlol_types import MLOLUser
+
+
+class MLOLClientPool:
+    # Authenticated clients for many accounts, given as dicts of MLOLClient
+    # arguments (domain, username, password, optionally library_id). Clients
+    # share the book cache (statuses are cached per account) and, per domain,
+    # connection pools. Logins and *_all() calls run for up to max_concurrency
+    # accounts at a time, and unless a rate_limiter is given, a shared one
+    # limits requests in flight to max_concurrency per host (each library
+    # site and the API).
+    # Results are keyed by "username@domain". Accounts that fail to log in
+    # are listed in failed and left out of the pool.
+
+    def __init__(
+        self,
+        accounts: Iterable[dict],
+        *,
+        cache: MLOLBookCache = None,
+        rate_limiter: MLOLRateLimiter = None,
+        max_concurrency: int = 10,
+        **client_kwargs,
+    ):
+        self.cache = cache if cache is not None else MemoryBookCache()
+        # each account's calls run their own worker threads
+        self.rate_limiter = rate_limiter or MLOLRateLimiter(
+            max_concurrency=max_concurrency
+        )
+        self.max_concurrency = max_concurrency
+        self._client_kwargs = client_kwargs
+        self._adapters: Dict[str, HTTPAdapter] = {}
+        self._adapters_lock = threading.Lock()
+        self.clients: Dict[str, MLOLClient] = {}
+        # accounts that couldn't log in, left out of clients
+        self.failed: List[str] = []
+
+        accounts = {f"{a['username']}@{a['domain']}": a for a in accounts}
+        for key, client in self._map(self._make_client, accounts).items():
+            if client is not None:
+                self.clients[key] = client
+            else:
+                self.failed.append(key)
+
+    def __repr__(self):
+        return f"<mlol_client.{type(self).__name__}: {list(self.clients)}>"
+
+    def __len__(self):
+        return len(self.clients)
+
+    def __getitem__(self, key: str) -> MLOLClient:
+        return self.clients[key]
+
+    def _get_adapter(self, domain: str) -> HTTPAdapter:
+        # one connection pool per host, sized for the whole pool
+        with self._adapters_lock:
+            if (adapter := self._adapters.get(domain)) is None:
+                pool_maxsize = max(self.max_concurrency * 3, DEFAULT_POOLSIZE)
+                adapter = MLOLRateLimitedAdapter(
+                    self.rate_limiter, pool_maxsize=pool_maxsize
+                )
+                self._adapters[domain] = adapter
+            return adapter
+
+    def _make_client(self, account: dict) -> Optional[MLOLClient]:
+        client = MLOLClient(
+            **{**self._client_kwargs, **account},
+            cache=self.cache,
+            rate_limiter=self.rate_limiter,
+            web_adapter=self._get_adapter(account["domain"]),
+            api_adapter=self._get_adapter("api.medialibrary.it"),
+        )
+        if not client.is_logged_in():
+            logging.error(f"Login failed for {account['username']}@{account['domain']}")
+            return
+        return client
+
+    def _map(
+        self, fn: Callable, items: Dict[str, object]
+    ) -> Dict[str, Optional[object]]:
+        # fn(item) for each item, None (and an error in the log) when it fails
+        if not items:
+            return {}
+
+        results = {}
+        with ThreadPoolExecutor(
+            max_workers=min(len(items), self.max_concurrency)
+        ) as executor:
+            futures = {k: executor.submit(_in_context(fn), v) for k, v in items.items()}
+            for key, future in futures.items():
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    logging.error(f"Request failed for {key}: {e}")
+                    results[key] = None
+        return results
+
+    def get_resources_all(
+        self, *, deep: bool = False, include: Iterable[str] = None
+    ) -> Dict[str, Optional[dict]]:
+        return self._map(
+            lambda c: c.get_resources(deep=deep, include=include), self.clients
+        )
+
+    def get_users_all(self) -> Dict[str, Optional[MLOLUser]]:
+        return self._map(lambda c: c.get_user(), self.clients)
@@ -0,0 +1,182 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from .mlol_policies import MLOLDeadlineExceeded, MLOLPolicyAdapter, _remaining_time
+
+# 429 and 5xx mean the site is struggling
+CONGESTION_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class _DomainLimiter:
+    # Token bucket for the request rate, plus a concurrency limit that grows by
+    # one per "window" of successful requests and halves on congestion (AIMD)
+
+    def __init__(
+        self,
+        *,
+        rate: float,
+        burst: int,
+        min_concurrency: int,
+        max_concurrency: int,
+        latency_target: float,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._last_refill) * self.rate
+        )
+        self._last_refill = now
+
+    def acquire(self) -> None:
+        # raises MLOLDeadlineExceeded if the deadline runs out while waiting
+        with self._condition:
+            while True:
+                remaining = _remaining_time()
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self.in_flight >= int(self.concurrency):
+                    # woken up by release()
+                    wait = None
+                elif self._tokens < 1:
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    self._tokens -= 1
+                    self.in_flight += 1
+                    return
+                if remaining is not None:
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._condition.wait(wait)
+
+    def release(
+        self, *, congested: bool, latency: float, retry_after: Optional[float] = None
+    ) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if congested or latency > self.latency_target:
+                # at most one decrease per round trip, requests that were already
+                # in flight saw the same congestion
+                if now - self._last_decrease > latency:
+                    self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+                    self._last_decrease = now
+                    logging.debug(f"Congestion, concurrency down to {self.concurrency}")
+            else:
+                self.concurrency = min(
+                    self.max_concurrency, self.concurrency + 1 / self.concurrency
+                )
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            self._condition.notify_all()
+
+
+class MLOLRateLimiter:
+    # Shared by every session and thread of one or more clients. Limits are
+    # per domain (web and API hosts are separate), with optional overrides:
+    #   MLOLRateLimiter(rate=5, domains={"api.medialibrary.it": {"rate": 1}})
+
+    def __init__(
+        self,
+        *,
+        rate: float = 10,
+        burst: int = None,
+        min_concurrency: int = 1,
+        max_concurrency: int = 8,
+        latency_target: float = 10,
+        domains: Dict[str, dict] = None,
+    ):
+        self.defaults = {
+            "rate": rate,
+            "burst": burst,
+            "min_concurrency": min_concurrency,
+            "max_concurrency": max_concurrency,
+            "latency_target": latency_target,
+        }
+        self.domains = domains or {}
+        self._limiters: Dict[str, _DomainLimiter] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<mlol_client.{type(self).__name__}: {self.stats}>"
+
+    @property
+    def stats(self) -> dict:
+        return {
+            domain: {
+                "concurrency": int(limiter.concurrency),
+                "in_flight": limiter.in_flight,
+            }
+            for domain, limiter in self._limiters.items()
+        }
+
+    def _get_limiter(self, domain: str) -> _DomainLimiter:
+        with self._lock:
+            if (limiter := self._limiters.get(domain)) is None:
+                config = {**self.defaults, **self.domains.get(domain, {})}
+                if config["burst"] is None:
+                    config["burst"] = max(1, int(config["rate"]))
+                limiter = self._limiters[domain] = _DomainLimiter(**config)
+            return limiter
+
+    @contextmanager
+    def limit(self, url: str):
+        # yields a callback to report the response status(es) of the request
+        limiter = self._get_limiter(urlparse(url).hostname)
+        limiter.acquire()
+        start = time.monotonic()
+        result = {"congested": False, "retry_after": None}
+
+        def report(status: int, retry_after: Optional[float] = None):
+            result["congested"] |= status in CONGESTION_STATUSES
+            if retry_after:
+                result["retry_after"] = retry_after
+
+        try:
+            yield report
+        except MLOLDeadlineExceeded:
+            raise
+        except Exception:
+            # timeouts and connection errors
+            result["congested"] = True
+            raise
+        finally:
+            limiter.release(latency=time.monotonic() - start, **result)
+
+
+class MLOLRateLimitedAdapter(MLOLPolicyAdapter):
+    def __init__(self, rate_limiter: MLOLRateLimiter, **kwargs):
+        self.rate_limiter = rate_limiter
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        # waiting for a slot counts towards the deadline
+        with self.rate_limiter.limit(request.url) as report:
+            response = super().send(request, **kwargs)
+            # urllib3 retries (429, 5xx...) happen within a single send()
+            if retries := getattr(response.raw, "retries", None):
+                for attempt in retries.history:
+                    if attempt.status:
+                        report(attempt.status)
+            try:
+                retry_after = float(response.headers.get("Retry-After", 0))
+            except ValueError:
+                retry_after = None
+            report(response.status_code, retry_after)
+            return response
@@ -0,0 +1,70 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from .mlol_library_mapping import _file_lock
+
+# sessions last a while on MLOL, but not forever
+DEFAULT_SESSION_MAX_AGE = 7 * 24 * 60 * 60
+
+
+class MLOLSessionStore:
+    # Keeps web cookies and API tokens per username@domain in a JSON file
+    # readable by the current user only, and shared by processes. Entries look like:
+    #   {"cookies": [{"name": ".ASPXAUTH", "value": ..., "domain": ..., "path": ...}],
+    #    "api_token": ..., "library_id": ..., "time": ...}
+
+    def __init__(self, path: str, *, max_age: float = DEFAULT_SESSION_MAX_AGE):
+        self.path = os.path.expanduser(path)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<mlol_client.{type(self).__name__}: {self.path}>"
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, encoding="utf8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logging.warning(f"Couldn't read session store {self.path}, ignoring it")
+            return {}
+
+    def _write(self, data: dict) -> None:
+        # write a private temporary file and rename it, so that readers never
+        # see a partial file and tokens are never world-readable
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.path)), prefix=".mlol_sessions"
+        )
+        try:
+            with os.fdopen(fd, "w", encoding="utf8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._read().get(key)
+        if entry and time.time() - entry.get("time", 0) <= self.max_age:
+            return entry
+
+    def set(self, key: str, entry: dict) -> None:
+        # other processes may have written since the last read
+        with self._lock, _file_lock(self.path):
+            data = self._read()
+            data[key] = {**entry, "time": time.time()}
+            self._write(data)
+
+    def delete(self, key: str) -> None:
+        with self._lock, _file_lock(self.path):
+            data = self._read()
+            if data.pop(key, None) is not None:
+                self._write(data)
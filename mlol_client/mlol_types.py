@@ -1,8 +1,93 @@
+import logging
+import sys
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
+# fields only available from the book page, fetched lazily for bound books
+BOOK_DETAIL_FIELDS = frozenset(
+    [
+        "title",
+        "authors",
+        "status",
+        "publisher",
+        "ISBNs",
+        "language",
+        "description",
+        "categories",
+        "year",
+        "formats",
+        "drm",
+    ]
+)
+
+
+def _intern(value):
+    # publishers, languages, authors, categories... repeat across many books
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, list):
+        return [_intern(v) for v in value]
+    return value
+
+
+def _format_date(date: Optional[datetime]) -> Optional[str]:
+    return date.isoformat() if date is not None else None
+
+
+def _parse_date(date: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(date) if date is not None else None
+
+
+class _MLOLType:
+    # subclasses list their public attributes in _fields, in constructor order
+    __slots__ = ()
+    _fields = ()
+
+    def _get(self, field: str):
+        # read a field without loading it, for types with lazy fields
+        return getattr(self, field)
+
+    def to_tuple(self) -> tuple:
+        return tuple(self.to_dict().values())
+
+    @classmethod
+    def from_tuple(cls, values: tuple):
+        return cls.from_dict(dict(zip(cls._fields, values)))
+
+    def to_dict(self) -> dict:
+        return {f: self._get(f) for f in self._fields}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(**data)
+
+    def __repr__(self):
+        values = {
+            k: "{}{}".format(str(v)[:50], "..." if len(str(v)) > 50 else "")
+            for k in self._fields
+            if (v := self._get(k)) is not None
+        }
+        return f"<mlol_client.{type(self).__name__}: {values}>"
+
+
+class MLOLBook(_MLOLType):
+    _fields = (
+        "id",
+        "title",
+        "authors",
+        "status",
+        "publisher",
+        "ISBNs",
+        "language",
+        "description",
+        "categories",
+        "year",
+        "formats",
+        "drm",
+    )
+    # set by clients with lazy_books=True, see MLOLClient.hydrate
+    __slots__ = _fields + ("_client", "_loaded_fields")
 
-class MLOLBook:
     def __init__(
         self,
         *,
@@ -21,27 +106,72 @@ class MLOLBook:
     ):
         self.id = str(id)
         self.title = title
-        self.authors = authors
-        self.status = status
-        self.publisher = publisher
+        self.authors = _intern(authors)
+        self.status = _intern(status)
+        self.publisher = _intern(publisher)
         self.ISBNs = ISBNs
-        self.language = language
+        self.language = _intern(language)
         self.description = description
-        self.categories = categories
+        self.categories = _intern(categories)
         self.year = year
-        self.formats = formats
-        self.drm = drm
+        self.formats = _intern(formats)
+        self.drm = _intern(drm)
+        self._client = None
+        self._loaded_fields = frozenset()
 
-    def __repr__(self):
-        values = {
-            k: "{}{}".format(str(v)[:50], "..." if len(str(v)) > 50 else "")
-            for k, v in self.__dict__.items()
-            if v is not None
-        }
-        return f"<mlol_client.MLOLBook: {values}>"
+    # Bound books leave the slots of missing details unset: reading them falls
+    # back to __getattr__, which fetches the details. Other reads are plain
+    # slot accesses, for bound and unbound books alike
+
+    def __getattr__(self, name):
+        if name not in BOOK_DETAIL_FIELDS:
+            raise AttributeError(
+                f"'{type(self).__name__}' object has no attribute '{name}'"
+            )
+        if self._client is not None:
+            errors = {}
+            self._client.hydrate([self], errors=errors)
+            if error := errors.get(self.id):
+                # still bound, fetched again on next access
+                logging.error(f"Failed to get details for book {self.id}: {error}")
+        return self._get(name)
+
+    def __reduce__(self):
+        # copies and pickles are unbound: no client and no fetching
+        return type(self).from_dict, (self.to_dict(),)
 
+    def _get(self, field: str):
+        try:
+            return object.__getattribute__(self, field)
+        except AttributeError:
+            return None
+
+    def _bind(self, client, loaded_fields: frozenset = frozenset()) -> None:
+        self._client = client
+        self._loaded_fields = loaded_fields
+        for field in BOOK_DETAIL_FIELDS - loaded_fields:
+            if self._get(field) is None:
+                delattr(self, field)
+
+    def _unbind(self) -> None:
+        self._client = None
+        for field in BOOK_DETAIL_FIELDS:
+            setattr(self, field, self._get(field))
+
+    def _update_details(self, book: "MLOLBook", fields: Optional[frozenset] = None):
+        for field in BOOK_DETAIL_FIELDS if fields is None else fields:
+            setattr(self, field, book._get(field))
+        self._loaded_fields = (
+            BOOK_DETAIL_FIELDS if fields is None else self._loaded_fields | fields
+        )
+
+    def _is_loaded(self, fields: Optional[frozenset] = None) -> bool:
+        return (BOOK_DETAIL_FIELDS if fields is None else fields) <= self._loaded_fields
+
+
+class MLOLLoan(_MLOLType):
+    __slots__ = _fields = ("id", "book", "start_date", "end_date")
 
-class MLOLLoan:
     def __init__(
         self,
         *,
@@ -55,16 +185,30 @@ class MLOLLoan:
         self.start_date = start_date
         self.end_date = end_date
 
-    def __repr__(self):
-        values = {
-            k: "{}{}".format(str(v)[:50], "..." if len(str(v)) > 50 else "")
-            for k, v in self.__dict__.items()
-            if v is not None
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "book": self.book.to_dict() if self.book else None,
+            "start_date": _format_date(self.start_date),
+            "end_date": _format_date(self.end_date),
         }
-        return f"<mlol_client.MLOLLoan: {values}>"
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MLOLLoan":
+        return cls(
+            id=data["id"],
+            book=MLOLBook.from_dict(data["book"]) if data.get("book") else None,
+            start_date=_parse_date(data.get("start_date")),
+            end_date=_parse_date(data.get("end_date")),
+        )
 
 
-class MLOLReservation:
+class MLOLReservation(_MLOLType):
+    _fields = ("id", "book", "date", "status", "queue_position")
+    # queue_position is a property, lazily loaded by the client
+    __slots__ = ("id", "book", "date", "status")
+    __slots__ += ("_queue_position", "_queue_position_loader")
+
     def __init__(
         self,
         *,
@@ -77,19 +221,60 @@ class MLOLReservation:
         self.id = str(id)
         self.book = book
         self.date = date
-        self.status = status
+        self.status = _intern(status)
         self.queue_position = queue_position
 
-    def __repr__(self):
-        values = {
-            k: "{}{}".format(str(v)[:50], "..." if len(str(v)) > 50 else "")
-            for k, v in self.__dict__.items()
-            if v is not None
-        }
-        return f"<mlol_client.MLOLReservation: {values}>"
+    def _get(self, field: str):
+        # don't trigger a request just to show or serialize the queue position
+        if field == "queue_position":
+            return self._queue_position
+        return super()._get(field)
+
+    @property
+    def queue_position(self) -> Optional[int]:
+        # resolved on first access when a loader was set by the client
+        if (loader := self._queue_position_loader) is not None:
+            self._queue_position = loader()
+            self._queue_position_loader = None
+        return self._queue_position
+
+    @queue_position.setter
+    def queue_position(self, queue_position: Optional[int]):
+        self._queue_position = queue_position
+        self._queue_position_loader = None
+
+    @property
+    def queue_position_loaded(self) -> bool:
+        return self._queue_position_loader is None
+
+    def to_dict(self) -> dict:
+        data = super().to_dict()
+        data["book"] = self.book.to_dict() if self.book else None
+        data["date"] = _format_date(self.date)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MLOLReservation":
+        return cls(
+            **{
+                **data,
+                "book": MLOLBook.from_dict(data["book"]) if data.get("book") else None,
+                "date": _parse_date(data.get("date")),
+            }
+        )
 
 
-class MLOLUser:
+class MLOLUser(_MLOLType):
+    __slots__ = _fields = (
+        "id",
+        "name",
+        "surname",
+        "username",
+        "remaining_loans",
+        "remaining_reservations",
+        "expiration_date",
+    )
+
     def __init__(
         self,
         *,
@@ -109,10 +294,13 @@ class MLOLUser:
         self.remaining_reservations = remaining_reservations
         self.expiration_date = expiration_date
 
-    def __repr__(self):
-        values = {
-            k: "{}{}".format(str(v)[:50], "..." if len(str(v)) > 50 else "")
-            for k, v in self.__dict__.items()
-            if v is not None
-        }
-        return f"<mlol_client.MLOLUser: {values}>"
+    def to_dict(self) -> dict:
+        data = super().to_dict()
+        data["expiration_date"] = _format_date(self.expiration_date)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MLOLUser":
+        return cls(
+            **{**data, "expiration_date": _parse_date(data.get("expiration_date"))}
+        )
@@ -0,0 +1,226 @@
+import heapq
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from .mlol_client import MLOLClient
+from .mlol_types import MLOLBook
+
+# called with the book (its status is the new one) and the previous status,
+# None on the first check
+WatchCallback = Callable[[MLOLBook, Optional[str]], None]
+
+
+class MLOLAvailabilityWatcher:
+    # Checks the status of a watchlist of books and calls back on changes.
+    # Books that keep their status are checked less and less often (up to
+    # max_interval), books that change go back to interval. Each cycle uses
+    # the cheapest way to check the books that are due:
+    # - a search of available books only (chkdispo), matched against the
+    #   watchlist, when it takes fewer pages than there are books to check
+    # - otherwise the status section of each book page
+
+    def __init__(
+        self,
+        client: MLOLClient,
+        books: Iterable[Union[MLOLBook, str]] = (),
+        *,
+        on_change: WatchCallback = None,
+        interval: float = 300,
+        max_interval: float = 3600,
+        backoff: float = 1.5,
+        jitter: float = 0.1,
+    ):
+        self.client = client
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.backoff = backoff
+        self.jitter = jitter
+        self.callbacks: List[WatchCallback] = [on_change] if on_change else []
+        self._statuses: Dict[str, Optional[str]] = {}
+        self._intervals: Dict[str, float] = {}
+        # (time of the next check, book ID), removed books are skipped when popped
+        self._schedule: List[Tuple[float, str]] = []
+        # pages of the last search of available books and when it was done
+        self._available_pages = None
+        self._available_pages_time = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        for book in books:
+            self.add(book)
+
+    def __repr__(self):
+        return f"<mlol_client.{type(self).__name__}: {len(self)} books>"
+
+    def __len__(self):
+        return len(self._statuses)
+
+    @property
+    def statuses(self) -> Dict[str, Optional[str]]:
+        with self._lock:
+            return dict(self._statuses)
+
+    def add(self, book: Union[MLOLBook, str]) -> None:
+        # books with a known status don't trigger a callback on their first check
+        book_id = book.id if isinstance(book, MLOLBook) else str(book)
+        status = book._get("status") if isinstance(book, MLOLBook) else None
+        with self._lock:
+            if book_id in self._statuses:
+                return
+            self._statuses[book_id] = status
+            self._intervals[book_id] = self.interval
+            heapq.heappush(self._schedule, (time.monotonic(), book_id))
+
+    def remove(self, book_id: str) -> None:
+        with self._lock:
+            self._statuses.pop(str(book_id), None)
+            self._intervals.pop(str(book_id), None)
+
+    def _get_due(self, now: float) -> List[str]:
+        due = []
+        with self._lock:
+            while self._schedule and self._schedule[0][0] <= now:
+                _, book_id = heapq.heappop(self._schedule)
+                if book_id in self._statuses:
+                    due.append(book_id)
+        return list(dict.fromkeys(due))
+
+    def _reschedule(self, book_id: str, changed: bool) -> None:
+        with self._lock:
+            if book_id not in self._statuses:
+                return
+            if changed:
+                interval = self.interval
+            else:
+                interval = min(
+                    self._intervals[book_id] * self.backoff, self.max_interval
+                )
+            self._intervals[book_id] = interval
+            # spread checks that would otherwise stay in lockstep
+            delay = interval * (1 + random.uniform(-self.jitter, self.jitter))
+            heapq.heappush(self._schedule, (time.monotonic() + delay, book_id))
+
+    def _get_available(self, book_ids: List[str]) -> Dict[str, MLOLBook]:
+        # watched books found in the available books search. Stops after the
+        # first page when the search is longer than the watchlist
+        params = {"seltip": 310, "keywords": "", "nris": 48, "chkdispo": "on"}
+        first_response, pages = self.client._get_first_search_page(params)
+        self._available_pages = pages
+        self._available_pages_time = time.monotonic()
+        if pages >= len(book_ids):
+            pages = 1
+
+        book_ids = set(book_ids)
+        available = {}
+        for page in self.client._search_books_paginated(
+            req_params=params,
+            pages=pages,
+            first_response=first_response,
+            prefetch=self.client.max_threads,
+        ):
+            for book in page:
+                if book is not None and book.id in book_ids:
+                    book.status = "available"
+                    available[book.id] = book
+        return available
+
+    def _get_books(
+        self, due: List[str], statuses: Dict[str, Optional[str]]
+    ) -> Dict[str, Optional[MLOLBook]]:
+        # book ID -> book with its current status. None or missing when the
+        # book is known to be unchanged or its check failed
+        books = {}
+        if self._available_pages_time is not None and (
+            time.monotonic() - self._available_pages_time > self.max_interval
+        ):
+            # the number of available books changes, look again from time to time
+            self._available_pages = None
+        if self.client.is_logged_in() and (
+            self._available_pages is None or self._available_pages < len(due)
+        ):
+            books = self._get_available(due)
+            if self._available_pages < len(due):
+                # the whole search was read: books that are not in it are not
+                # available, only those that were need to be checked
+                for book_id in due:
+                    if book_id not in books and statuses[book_id] not in (
+                        None,
+                        "available",
+                    ):
+                        books[book_id] = None
+
+        pending = [book_id for book_id in due if book_id not in books]
+        errors = {}
+        books.update(
+            self.client._get_books_by_id(pending, fields={"status"}, errors=errors)
+        )
+        for book_id, error in errors.items():
+            logging.error(f"Failed to check book {book_id}: {error}")
+        return books
+
+    def check(self) -> List[Tuple[MLOLBook, Optional[str]]]:
+        # checks the books that are due, returns their changes as (book, old status)
+        if not (due := self._get_due(time.monotonic())):
+            return []
+
+        statuses = self.statuses
+        try:
+            books = self._get_books(due, statuses)
+        except Exception:
+            # due books are off the schedule, put them back before giving up
+            logging.exception("Failed to check watched books")
+            for book_id in due:
+                self._reschedule(book_id, changed=False)
+            return []
+
+        changes = []
+        for book_id in due:
+            book = books.get(book_id)
+            if book is None or book.status is None:
+                # unchanged, or the check failed
+                self._reschedule(book_id, changed=False)
+                continue
+
+            old_status = statuses[book_id]
+            changed = book.status != old_status
+            with self._lock:
+                if book_id in self._statuses:
+                    self._statuses[book_id] = book.status
+            self._reschedule(book_id, changed=changed)
+            if changed:
+                logging.info(f"Book {book_id}: {old_status} -> {book.status}")
+                changes.append((book, old_status))
+
+        for book, old_status in changes:
+            for callback in self.callbacks:
+                try:
+                    callback(book, old_status)
+                except Exception:
+                    logging.exception(f"Watch callback failed for book {book.id}")
+        return changes
+
+    def run(self, *, duration: float = None) -> None:
+        # checks books as they become due until stop() is called or duration
+        # (seconds) has passed
+        self._stop.clear()
+        end = time.monotonic() + duration if duration is not None else None
+        while not self._stop.is_set():
+            # a failed cycle doesn't stop the watcher
+            try:
+                self.check()
+            except Exception:
+                logging.exception("Watch cycle failed")
+            with self._lock:
+                next_check = self._schedule[0][0] if self._schedule else None
+            now = time.monotonic()
+            if end is not None and now >= end:
+                return
+            wait = max(0, next_check - now) if next_check is not None else None
+            if end is not None:
+                wait = min(wait, end - now) if wait is not None else end - now
+            self._stop.wait(wait)
+
+    def stop(self) -> None:
+        self._stop.set()
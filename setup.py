@@ -14,4 +14,5 @@ setuptools.setup(
     url="https://github.com/ftruzzi/mlol_client",
     packages=setuptools.find_packages(),
     python_requires=">=3.8",
+    extras_require={"async": ["httpx"], "lxml": ["lxml"]},
 )
@@ -0,0 +1,53 @@
+import asyncio
+import os
+
+import pytest
+import vcr
+
+from mlol_client import AsyncMLOLClient, MLOLBook
+
+CASSETTE_BASE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "cassettes"
+)
+
+
+async def _get_book(book_id):
+    async with AsyncMLOLClient() as client:
+        return await client.get_book_by_id(book_id)
+
+
+async def _search(query):
+    async with AsyncMLOLClient() as client:
+        results = []
+        async for page in client.search_books(query):
+            results += page
+        return results
+
+
+def test_async_book():
+    with vcr.use_cassette(
+        os.path.join(CASSETTE_BASE_PATH, "test_book", "test_book[book].yaml"),
+        record_mode="none",
+    ):
+        book = asyncio.run(_get_book("150208516"))
+
+    assert book.title == "Spillover. L'evoluzione delle pandemie"
+    assert book.ISBNs == ["9788845982484", "9788845932045"]
+    assert book.formats == ["epub"] and book.drm == "adobe"
+
+
+@pytest.mark.parametrize(
+    "cassette, query, pages",
+    [
+        ("no_search_results.yaml", "asdqwedasdzxc", 0),
+        ("search_results_multiple_pages.yaml", "filosofia", 17),
+    ],
+)
+def test_async_search(cassette, query, pages):
+    with vcr.use_cassette(
+        os.path.join(CASSETTE_BASE_PATH, "test_search", cassette), record_mode="none"
+    ):
+        results = asyncio.run(_search(query))
+
+    assert all(isinstance(b, MLOLBook) for b in results)
+    assert len(results) > (pages - 1) * 48 if pages else len(results) == 0
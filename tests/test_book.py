@@ -1,9 +1,132 @@
+import copy
+import os
+import pickle
+
 import pytest
+import requests
+import vcr
 from pytest_cases import parametrize_with_cases
 
+from mlol_client import MLOLBook, MLOLClient
+from mlol_client.mlol_constants import BOOK_PAGE_SECTIONS
+
+CASSETTE_BASE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "cassettes", "test_book"
+)
+SEARCH_CASSETTE = "search_results_single_page.yaml"
+
 
 @pytest.mark.vcr(record_mode="none")
 @parametrize_with_cases("book_id, expected")
 def test_book(client_no_auth, book_id, expected):
-    book_dict = client_no_auth.get_book_by_id(book_id).__dict__
+    book_dict = client_no_auth.get_book_by_id(book_id).to_dict()
     assert all(v == book_dict[k] for k, v in expected.items())
+
+
+@parametrize_with_cases("book_id, expected")
+def test_book_fields(client_no_auth, book_id, expected, current_cases):
+    # reuse the cassettes recorded for test_book
+    cassette = os.path.join(
+        CASSETTE_BASE_PATH, f"test_book[{current_cases['book_id'].id}].yaml"
+    )
+    with vcr.use_cassette(cassette, record_mode="none", allow_playback_repeats=True):
+        full_dict = client_no_auth.get_book_by_id(book_id).to_dict()
+        # every field parsed on its own matches the full parse
+        for field in BOOK_PAGE_SECTIONS:
+            book_dict = client_no_auth.get_book_by_id(book_id, fields=[field]).to_dict()
+            assert book_dict[field] == full_dict[field], field
+            assert book_dict["title"] == full_dict["title"]
+            assert all(
+                v is None
+                for k, v in book_dict.items()
+                if k not in (field, "id", "title")
+            )
+
+
+def test_book_unknown_fields(client_no_auth):
+    with pytest.raises(ValueError):
+        client_no_auth.get_book_by_id("150208516", fields=["cover"])
+
+
+@pytest.fixture
+def lazy_books():
+    client = MLOLClient(lazy_books=True)
+    with vcr.use_cassette(
+        os.path.join(CASSETTE_BASE_PATH, "..", "test_search", SEARCH_CASSETTE),
+        record_mode="none",
+    ):
+        return next(client.search_books("quammen"))
+
+
+def test_lazy_book(lazy_books):
+    book = next(b for b in lazy_books if b.id == "150208516")
+    with vcr.use_cassette(
+        os.path.join(CASSETTE_BASE_PATH, "test_book[book].yaml"), record_mode="none"
+    ) as cassette:
+        assert cassette.play_count == 0
+        assert book.ISBNs == ["9788845982484", "9788845932045"]
+        assert book.formats == ["epub"] and book.drm == "adobe"
+        assert cassette.play_count == 1
+
+
+def test_lazy_book_copies(lazy_books):
+    book = next(b for b in lazy_books if b.id == "150208516")
+    with vcr.use_cassette(
+        os.path.join(CASSETTE_BASE_PATH, "test_book[book].yaml"), record_mode="none"
+    ) as cassette:
+        copies = [copy.copy(book), copy.deepcopy(book)]
+        copies.append(pickle.loads(pickle.dumps(book)))
+        assert cassette.play_count == 0
+
+    # copies are unbound, missing details stay missing
+    for book_copy in copies:
+        assert book_copy.to_dict() == book.to_dict()
+        assert book_copy.ISBNs is None and book_copy._client is None
+
+
+def test_hydrate_fields(lazy_books):
+    client = MLOLClient(lazy_books=True)
+    book = next(b for b in lazy_books if b.id == "150208516")
+    with vcr.use_cassette(
+        os.path.join(CASSETTE_BASE_PATH, "test_book[book].yaml"),
+        record_mode="none",
+        allow_playback_repeats=True,
+    ) as cassette:
+        client.hydrate([book], fields=["ISBNs"])
+        assert book.to_dict()["ISBNs"] == ["9788845982484", "9788845932045"]
+        assert book.to_dict()["publisher"] is None
+        assert cassette.play_count == 1
+
+        # fields that were not hydrated are still fetched on access
+        assert book.publisher == "Adelphi"
+        assert cassette.play_count == 2
+
+
+def test_hydrate_failures(monkeypatch):
+    client = MLOLClient(lazy_books=True)
+    books = client._bind_books(
+        [MLOLBook(id="1", title="one"), MLOLBook(id="2", title="two")]
+    )
+    fail = {"1"}
+
+    def get_book_by_id(book_id, *, fields=None):
+        if book_id in fail:
+            raise requests.exceptions.ReadTimeout("timeout")
+        return MLOLBook(id=book_id, title="two", publisher="Adelphi")
+
+    monkeypatch.setattr(client, "get_book_by_id", get_book_by_id)
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        client.hydrate(books)
+    # the failed book is still bound, the other one is hydrated
+    assert books[1].publisher == "Adelphi" and books[1]._is_loaded()
+    assert books[0]._client is client and not books[0]._is_loaded()
+
+    # failures can be collected instead
+    errors = {}
+    client.hydrate(books, errors=errors)
+    assert list(errors) == ["1"] and not books[0]._is_loaded()
+
+    # reading a detail of a failed book doesn't raise and retries the fetch
+    assert books[0].publisher is None
+    fail.clear()
+    assert books[0].publisher == "Adelphi"
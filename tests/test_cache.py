@@ -0,0 +1,147 @@
+import os
+
+import pytest
+import requests
+import vcr
+from pytest_cases import parametrize, fixture
+
+from mlol_client import (
+    MLOLBook,
+    MLOLBookCache,
+    MLOLClient,
+    MemoryBookCache,
+    SQLiteBookCache,
+)
+
+CASSETTE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    "cassettes",
+    "test_book",
+    "test_book[book].yaml",
+)
+BOOK_ID = "150208516"
+
+
+@fixture
+@parametrize("backend", ["memory", "sqlite"])
+def cache(backend, tmp_path):
+    if backend == "memory":
+        return MemoryBookCache()
+    return SQLiteBookCache(str(tmp_path / "books.sqlite"))
+
+
+def test_cache_hit(cache):
+    client = MLOLClient(cache=cache)
+    # the cassette only allows a single request to the book page
+    with vcr.use_cassette(CASSETTE_PATH, record_mode="none"):
+        book = client.get_book_by_id(BOOK_ID)
+        cached_book = client.get_book_by_id(BOOK_ID)
+
+    assert cached_book.to_dict() == book.to_dict()
+    assert cache.stats == {"hits": 1, "misses": 1}
+
+
+def test_cache_status_ttl(cache):
+    cache.status_ttl = 0
+    with vcr.use_cassette(CASSETTE_PATH, record_mode="none"):
+        book = MLOLClient(cache=cache).get_book_by_id(BOOK_ID)
+
+    assert cache.get("medialibrary.it", BOOK_ID) is None
+    metadata_only = cache.get("medialibrary.it", BOOK_ID, with_status=False)
+    assert metadata_only.status is None and metadata_only.ISBNs == book.ISBNs
+
+
+def test_cache_invalidation(cache):
+    with vcr.use_cassette(CASSETTE_PATH, record_mode="none"):
+        MLOLClient(cache=cache).get_book_by_id(BOOK_ID)
+
+    cache.invalidate("medialibrary.it", BOOK_ID, status_only=True)
+    assert cache.get("medialibrary.it", BOOK_ID) is None
+    assert cache.get("medialibrary.it", BOOK_ID, with_status=False) is not None
+
+    cache.invalidate(book_id=BOOK_ID)
+    assert cache.get("medialibrary.it", BOOK_ID, with_status=False) is None
+
+
+def test_incomplete_backend():
+    class IncompleteCache(MLOLBookCache):
+        def _load(self, domain, book_id):
+            return None
+
+    with pytest.raises(TypeError):
+        IncompleteCache()
+
+
+SEARCH_CASSETTE_BASE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "cassettes", "test_search"
+)
+ISBN = "978-88-459-8248-4"
+MISSING_ISBN = "9780000000002"
+
+
+def test_resolve_isbns(cache, monkeypatch):
+    client = MLOLClient(cache=cache)
+    with vcr.use_cassette(CASSETTE_PATH, record_mode="none"):
+        client.get_book_by_id(BOOK_ID)
+
+    # search cassettes stand in for the ISBN searches: "quammen" has several
+    # results (checked against the cached book page), the other none at all
+    searches = {"9788845982484": "quammen", MISSING_ISBN: "asdqwedasdzxc"}
+    get_first_search_page = client._get_first_search_page
+    monkeypatch.setattr(
+        client,
+        "_get_first_search_page",
+        lambda params: get_first_search_page(
+            {**params, "keywords": searches[params["keywords"]]}
+        ),
+    )
+    # candidates are checked in parallel, only the cached one has the ISBN
+    get_book_by_id = client.get_book_by_id
+    candidates = []
+
+    def get_candidate(book_id, *, fields=None):
+        candidates.append(book_id)
+        if book_id == BOOK_ID:
+            return get_book_by_id(book_id, fields=fields)
+        return MLOLBook(id=book_id, title="", ISBNs=[])
+
+    monkeypatch.setattr(client, "get_book_by_id", get_candidate)
+    with vcr.use_cassette(
+        os.path.join(SEARCH_CASSETTE_BASE_PATH, "search_results_single_page.yaml"),
+        record_mode="none",
+    ):
+        assert client.resolve_isbns([ISBN]) == {ISBN: BOOK_ID}
+    assert BOOK_ID in candidates and len(candidates) == len(set(candidates)) > 1
+    with vcr.use_cassette(
+        os.path.join(SEARCH_CASSETTE_BASE_PATH, "no_search_results.yaml"),
+        record_mode="none",
+    ):
+        assert client.resolve_isbns([MISSING_ISBN]) == {MISSING_ISBN: None}
+
+    # negative results are cached too, no requests needed. ISBN lookups
+    # are counted apart from books
+    stats, isbn_stats = cache.stats, cache.isbn_stats
+    assert cache.get_isbns("medialibrary.it", ["9788845982484", MISSING_ISBN]) == {
+        "9788845982484": BOOK_ID,
+        MISSING_ISBN: None,
+    }
+    assert client.resolve_isbns([MISSING_ISBN, "9788845982484"]) == {
+        MISSING_ISBN: None,
+        "9788845982484": BOOK_ID,
+    }
+    assert cache.stats == stats
+    assert cache.isbn_stats["hits"] == isbn_stats["hits"] + 4
+
+
+def test_resolve_isbns_failure(cache, monkeypatch):
+    client = MLOLClient(cache=cache)
+
+    def resolve_isbn(isbn):
+        if isbn == MISSING_ISBN:
+            raise requests.exceptions.ReadTimeout("timeout")
+        return BOOK_ID
+
+    # failed lookups are neither returned nor cached, unlike missing ISBNs
+    monkeypatch.setattr(client, "_resolve_isbn", resolve_isbn)
+    assert client.resolve_isbns([ISBN, MISSING_ISBN]) == {ISBN: BOOK_ID}
+    assert cache.get_isbns("medialibrary.it", [MISSING_ISBN]) == {}
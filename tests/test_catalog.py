@@ -0,0 +1,264 @@
+import gzip
+import json
+import os
+
+import pytest
+import requests
+import vcr
+
+from mlol_client import (
+    MLOLBook,
+    MLOLClient,
+    MLOLCatalogCrawler,
+    MLOLCatalogIndex,
+    MLOLCatalogSync,
+)
+
+CASSETTE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    "cassettes",
+    "test_search",
+    "search_results_multiple_pages.yaml",
+)
+
+QUERY = "filosofia"
+PAGES = 17
+BOOKS = 782
+
+
+def opener(path):
+    return gzip.open if path.endswith(".gz") else open
+
+
+def read_ids(path):
+    with opener(path)(path, "rt", encoding="utf8") as f:
+        return [json.loads(line)["id"] for line in f]
+
+
+@pytest.mark.parametrize("filename", ["catalog.jsonl", "catalog.jsonl.gz"])
+def test_crawl_resume(tmp_path, monkeypatch, filename):
+    output_path = str(tmp_path / filename)
+    client = MLOLClient()
+    get_search_page = client._get_search_page
+    fetched = []
+    fail_on = {9}
+
+    def failing_get_search_page(*, req_params, page):
+        fetched.append(page)
+        if page in fail_on:
+            raise ConnectionError
+        return get_search_page(req_params=req_params, page=page)
+
+    monkeypatch.setattr(client, "_get_search_page", failing_get_search_page)
+    with vcr.use_cassette(
+        CASSETTE_PATH, record_mode="none", allow_playback_repeats=True
+    ):
+        with pytest.raises(ConnectionError):
+            MLOLCatalogCrawler(client, output_path, query=QUERY, max_workers=3).run()
+
+        # pages before the failure are kept, anything after is discarded
+        partial_ids = read_ids(output_path)
+        with open(f"{output_path}.checkpoint") as f:
+            assert json.loads(f.read().splitlines()[-1])["page"] == 8
+
+        fetched.clear()
+        fail_on.clear()
+        written = MLOLCatalogCrawler(client, output_path, query=QUERY).run()
+
+    ids = read_ids(output_path)
+    assert ids[: len(partial_ids)] == partial_ids
+    assert len(ids) == len(set(ids)) == BOOKS
+    assert written == BOOKS - len(partial_ids)
+    assert sorted(fetched) == list(range(9, PAGES + 1))
+
+
+def test_crawl_different_query(tmp_path):
+    output_path = str(tmp_path / "catalog.jsonl")
+    with open(f"{output_path}.checkpoint", "w") as f:
+        f.write(json.dumps({"query": "", "deep": False, "fields": None}) + "\n")
+
+    crawler = MLOLCatalogCrawler(MLOLClient(), output_path, query=QUERY)
+    assert crawler.run() is None
+
+
+SINGLE_PAGE_CASSETTE_PATH = os.path.join(
+    os.path.dirname(CASSETTE_PATH), "search_results_single_page.yaml"
+)
+
+
+def test_crawl_deep_failure(tmp_path, monkeypatch):
+    output_path = str(tmp_path / "catalog.jsonl")
+    client = MLOLClient()
+    fail = True
+
+    def get_book_by_id(book_id, *, fields=None):
+        if fail:
+            raise requests.exceptions.ReadTimeout("timeout")
+        return MLOLBook(id=book_id, title="", status="available")
+
+    monkeypatch.setattr(client, "get_book_by_id", get_book_by_id)
+    crawler = MLOLCatalogCrawler(client, output_path, query="quammen", deep=True)
+    with vcr.use_cassette(
+        SINGLE_PAGE_CASSETTE_PATH, record_mode="none", allow_playback_repeats=True
+    ):
+        # shallow books are not written, the page is not checkpointed
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            crawler.run()
+        assert os.path.getsize(output_path) == 0
+        with open(f"{output_path}.checkpoint") as f:
+            assert len(f.read().splitlines()) == 1
+
+        fail = False
+        written = crawler.run()
+
+    with open(output_path, encoding="utf8") as f:
+        records = [json.loads(line) for line in f]
+    assert written == len(records) > 0
+    assert all(r["status"] == "available" for r in records)
+
+
+@pytest.fixture
+def latest_books():
+    # stand-in for the "news" listing, which has no cassette
+    with vcr.use_cassette(SINGLE_PAGE_CASSETTE_PATH, record_mode="none"):
+        return list(MLOLClient().search_books("quammen"))
+
+
+@pytest.mark.parametrize("filename", ["catalog.jsonl", "catalog.jsonl.gz"])
+def test_sync(tmp_path, monkeypatch, latest_books, filename):
+    catalog_path = str(tmp_path / filename)
+    known, unseen = latest_books[0][:2], latest_books[0][2:]
+    with opener(catalog_path)(catalog_path, "wt", encoding="utf8") as f:
+        for book in [MLOLBook(id="1", title="Old book"), *known]:
+            f.write(json.dumps(book.to_dict()) + "\n")
+
+    client = MLOLClient()
+    hydrated = []
+    failing = set()
+
+    def hydrate(books, *, fields=None, errors=None):
+        hydrated.append(([b.id for b in books], fields))
+        for book in books:
+            if book.id in failing:
+                errors[book.id] = requests.exceptions.ReadTimeout("timeout")
+            else:
+                book.status = "available"
+        return books
+
+    monkeypatch.setattr(client, "get_latest_books", lambda: iter(latest_books))
+    monkeypatch.setattr(client, "hydrate", hydrate)
+    sync = MLOLCatalogSync(client, catalog_path, refresh_status=1)
+    assert sync.last_sync is None
+    result = sync.run(refresh_ids=["1"])
+
+    # full details only for unseen books, status for a bounded set of known ones
+    assert hydrated == [([b.id for b in unseen], None), (["1"], {"status"})]
+    assert result["added"] == len(unseen) and result["refreshed"] == 1
+    assert result["failed"] == 0
+    assert sync.last_sync is not None
+
+    with opener(catalog_path)(catalog_path, "rt", encoding="utf8") as f:
+        records = {(r := json.loads(line))["id"]: r for line in f}
+    assert len(records) == 1 + len(known) + len(unseen)
+    assert records["1"]["status"] == "available"
+    assert records[known[0].id]["status"] is None
+
+    # failed books are neither added nor refreshed, and unseen ones are
+    # tried again on the next sync
+    failing.update([unseen[0].id, "1"])
+    hydrated.clear()
+    catalog = {**records}
+    del catalog[unseen[0].id]
+    catalog["1"]["status"] = "taken"
+    with opener(catalog_path)(catalog_path, "wt", encoding="utf8") as f:
+        for record in catalog.values():
+            f.write(json.dumps(record) + "\n")
+    result = sync.run(refresh_ids=["1"])
+    assert hydrated[0] == ([unseen[0].id], None)
+    assert result["added"] == 0 and result["refreshed"] == 0
+    assert result["failed"] == 2
+    with opener(catalog_path)(catalog_path, "rt", encoding="utf8") as f:
+        records = {(r := json.loads(line))["id"]: r for line in f}
+    assert unseen[0].id not in records and records["1"]["status"] == "taken"
+
+
+def test_sync_gap_warning(tmp_path, monkeypatch, caplog):
+    catalog_path = str(tmp_path / "catalog.jsonl")
+    open(catalog_path, "w").close()
+    with open(f"{catalog_path}.sync", "w") as f:
+        json.dump({"last_sync": "2020-01-01T00:00:00"}, f)
+
+    client = MLOLClient()
+    monkeypatch.setattr(client, "get_latest_books", lambda: iter([]))
+    MLOLCatalogSync(client, catalog_path).run()
+    assert "consider a full crawl" in caplog.text
+
+
+INDEX_BOOKS = [
+    MLOLBook(
+        id="150208516",
+        title="Spillover. L'evoluzione delle pandemie",
+        authors=["David Quammen"],
+        publisher="Adelphi",
+        ISBNs=["9788845982484", "9788845932045"],
+        categories=[["Scienze umane", "Società"]],
+        year=2020,
+        formats=["epub"],
+        drm="adobe",
+    ),
+    MLOLBook(
+        id="150218115",
+        title="L'albero intricato",
+        authors=["David Quammen"],
+        publisher="Adelphi",
+        ISBNs=["9788845983757"],
+        year=2020,
+        formats=["epub", "pdf"],
+        drm="social",
+    ),
+    MLOLBook(id="1", title="Pandemie di ieri", year=1990, formats=["pdf"]),
+]
+
+
+def test_index_search():
+    index = MLOLCatalogIndex(INDEX_BOOKS)
+    ids = lambda books: [b.id for b in books]
+
+    assert len(index) == 3
+    assert ids(index.search("quammen")) == ["150208516", "150218115"]
+    assert ids(index.search("PANDEMIE")) == ["150208516", "1"]
+    assert ids(index.search("pandemie quammen")) == ["150208516"]
+    assert ids(index.search("societa")) == ["150208516"]
+    assert ids(index.search("quammen", formats=["pdf"])) == ["150218115"]
+    assert ids(index.search("pandemie", max_year=2000)) == ["1"]
+    assert ids(index.search(drm="adobe")) == ["150208516"]
+    assert index.search("virus") == []
+
+    assert index.search("978-88-459-3204-5") == [INDEX_BOOKS[0]]
+    assert index.get_book_by_isbn("9788845983757") is INDEX_BOOKS[1]
+
+    index.remove("150208516")
+    assert ids(index.search("quammen")) == ["150218115"]
+    assert index.get_book_by_isbn("9788845982484") is None
+
+
+def test_index_from_catalog(tmp_path):
+    catalog_path = str(tmp_path / "catalog.jsonl.gz")
+    with opener(catalog_path)(catalog_path, "wt", encoding="utf8") as f:
+        for book in INDEX_BOOKS:
+            f.write(json.dumps(book.to_dict()) + "\n")
+
+    index = MLOLCatalogIndex.from_catalog(catalog_path, max_age=60)
+    assert [b.to_dict() for b in index.search()] == [b.to_dict() for b in INDEX_BOOKS]
+    assert not index.is_stale
+
+
+def test_index_live_fallback(latest_books):
+    client = MLOLClient()
+    index = MLOLCatalogIndex(INDEX_BOOKS, client=client, built_at=0, max_age=60)
+    assert index.is_stale
+    assert len(index.search("quammen")) == 2
+
+    with vcr.use_cassette(SINGLE_PAGE_CASSETTE_PATH, record_mode="none"):
+        results = index.search("quammen", live_fallback=True)
+    assert [b.id for b in results] == [b.id for b in latest_books[0]]
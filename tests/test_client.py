@@ -1,3 +1,13 @@
+import multiprocessing
+import os
+import stat
+import time
+
+import pytest
+
+from mlol_client import MLOLClient, MLOLLibraryMapping, SQLiteLibraryMapping
+
+
 def test_unauthenticated_base_url(client_no_auth):
     assert client_no_auth.session.base_url == "https://medialibrary.it"
 
@@ -23,3 +33,80 @@ def test_authentication_failure(client_failed_auth):
         and cookies.get("X_MLOL_User") is None
         and client_failed_auth.api_token is None
     )
+
+
+def test_connection_pool_size():
+    client = MLOLClient(max_threads=32)
+    web_adapter = client.session.get_adapter(client.session.base_url)
+    api_adapter = client.api_session.get_adapter("https://api.medialibrary.it")
+    assert web_adapter._pool_maxsize == api_adapter._pool_maxsize == 32
+
+
+def test_library_id_discovery(tmp_path, monkeypatch):
+    library_mapping = MLOLLibraryMapping(str(tmp_path / "library_mapping.json"))
+    library_mapping.set("a@csbno.medialibrary.it", "9")
+    library_mapping.set("b@other.medialibrary.it", "3")
+    client = MLOLClient(
+        domain="csbno.medialibrary.it",
+        max_threads=2,
+        library_mapping=library_mapping,
+    )
+    attempts = []
+
+    def login_web(*, username, password, library_id, session):
+        attempts.append((library_id, session))
+        time.sleep(0.05)
+        if library_id == "7":
+            session.cookies.set(".ASPXAUTH", "auth")
+            return True
+        return False
+
+    monkeypatch.setattr(client, "_login_web", login_web)
+    library_id = client._discover_library_id(
+        username="user", password="pass", library_ids=[str(i) for i in range(1, 20)]
+    )
+
+    assert library_id == "7"
+    assert client.session.cookies.get(".ASPXAUTH") == "auth"
+    # the hint goes first, and the remaining candidates are dropped
+    assert attempts[0][0] == "9"
+    assert len(attempts) < 19
+    assert len({id(session) for _, session in attempts}) == len(attempts)
+
+
+def set_library_ids(mapping_class, path, worker):
+    mapping = mapping_class(path)
+    for i in range(20):
+        mapping.set(f"user{worker}_{i}@csbno.medialibrary.it", str(i))
+
+
+@pytest.mark.parametrize("mapping_class", [MLOLLibraryMapping, SQLiteLibraryMapping])
+def test_library_mapping_processes(tmp_path, mapping_class):
+    path = str(tmp_path / "library_mapping")
+    mapping = mapping_class(path)
+    assert mapping.get("user0_0@csbno.medialibrary.it") is None
+
+    # no lost updates with concurrent writers
+    processes = [
+        multiprocessing.Process(target=set_library_ids, args=(mapping_class, path, w))
+        for w in range(4)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+    # the cached view notices changes made by other processes
+    assert len(mapping.to_dict()) == 80
+    assert mapping.get("user3_19@csbno.medialibrary.it") == "19"
+
+
+def test_library_mapping_mode(tmp_path):
+    path = str(tmp_path / "library_mapping.json")
+    mapping = MLOLLibraryMapping(path)
+    # readable by other users, and the existing mode is kept on later writes
+    mapping.set("user@csbno.medialibrary.it", "1")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+    os.chmod(path, 0o640)
+    mapping.set("user@csbno.medialibrary.it", "2")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
@@ -0,0 +1,201 @@
+import io
+import os
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from mlol_client import MLOLBook, MLOLBulkDownloader, MLOLClient, MLOLLoan, MLOLUser
+
+ACSM = b"<fulfillmentToken>" + b"x" * 200_000 + b"</fulfillmentToken>"
+BOOK = MLOLBook(
+    id="150208516",
+    title="Spillover",
+    status="available",
+    formats=["epub"],
+    drm="adobe",
+)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # the download page redirects to the ACS server, which streams the file
+    server = {"body": ACSM, "requests": []}
+
+    def send(adapter, request, **kwargs):
+        server["requests"].append((request.url, kwargs.get("stream")))
+        response = requests.Response()
+        response.request, response.url = request, request.url
+        response.status_code = 200
+        if "downloadebadok.aspx" in request.url:
+            response.status_code = 302
+            response.headers["Location"] = "https://acs.example.com/fulfill"
+            response.raw = io.BytesIO(b"")
+        else:
+            response.raw = io.BytesIO(server["body"])
+        return response
+
+    monkeypatch.setattr(HTTPAdapter, "send", send)
+    return server
+
+
+@pytest.fixture
+def client():
+    client = MLOLClient(domain="csbno.medialibrary.it")
+    client.session.cookies.set(".ASPXAUTH", "auth")
+    client.api_token = "token"
+    return client
+
+
+def test_iter_book_download(client, server):
+    chunks = client.iter_book_download(BOOK, chunk_size=1024)
+    # only the page and the first chunk are read until the caller asks for more
+    assert len(server["requests"]) == 2 and all(s for _, s in server["requests"])
+    assert b"".join(chunks) == ACSM
+
+
+def test_download_book_to(client, server, tmp_path):
+    path = str(tmp_path / "spillover.acsm")
+    assert client.download_book_to(BOOK, path) == len(ACSM)
+    with open(path, "rb") as f:
+        assert f.read() == ACSM
+
+    file = io.BytesIO()
+    assert client.download_book_to(BOOK, file) == len(ACSM)
+    assert file.getvalue() == ACSM
+    assert client.download_book(BOOK) == ACSM
+
+
+def test_download_failure(client, server, tmp_path):
+    server["body"] = b"<html>error</html>"
+    path = str(tmp_path / "spillover.acsm")
+    assert client.download_book_to(BOOK, path) is None
+    assert os.listdir(tmp_path) == []
+    assert client.download_book(BOOK) is None
+
+
+def test_download_unresolved_book(client, server, monkeypatch):
+    fetched = []
+
+    def get_book_by_id(book_id, *, fields=None):
+        fetched.append(book_id)
+        return BOOK
+
+    monkeypatch.setattr(client, "get_book_by_id", get_book_by_id)
+    # search results have no status and DRM yet
+    assert client.download_book(MLOLBook(id=BOOK.id, title=BOOK.title)) == ACSM
+    assert fetched == [BOOK.id]
+
+
+@pytest.fixture
+def account(client, monkeypatch):
+    owned = MLOLBook(id="1", title=None)
+    loans = [MLOLLoan(id="99", book=owned, start_date=None, end_date=None)]
+    account = {"remaining_loans": 1, "loans": loans, "calls": []}
+
+    def get_user():
+        account["calls"].append("user")
+        return MLOLUser(
+            id=1,
+            name="Mario",
+            surname="Rossi",
+            username="mrossi",
+            remaining_loans=account["remaining_loans"],
+            remaining_reservations=1,
+            expiration_date=None,
+        )
+
+    def get_active_loans():
+        account["calls"].append("loans")
+        return account["loans"]
+
+    monkeypatch.setattr(client, "get_user", get_user)
+    monkeypatch.setattr(client, "_get_active_loans", get_active_loans)
+    return account
+
+
+def _make_book(book_id, status):
+    return MLOLBook(
+        id=book_id, title=None, status=status, formats=["epub"], drm="adobe"
+    )
+
+
+def test_bulk_download(client, server, account, tmp_path):
+    books = [_make_book("1", "owned"), _make_book("2", "available")]
+    books += [_make_book("3", "available"), _make_book("4", "taken")]
+    downloader = MLOLBulkDownloader(client, str(tmp_path), max_workers=2)
+    results = downloader.run(books)
+
+    # owned books don't use the quota, the second new loan is over it
+    assert results == {
+        "1": str(tmp_path / "1.acsm"),
+        "2": str(tmp_path / "2.acsm"),
+        "3": None,
+        "4": None,
+    }
+    assert account["calls"] == ["user", "loans"]
+    assert any("dlrepeat.aspx?idp=99" in url for url, _ in server["requests"])
+    with open(tmp_path / "2.acsm", "rb") as f:
+        assert f.read() == ACSM
+
+    # finished books are skipped on the next run
+    account["remaining_loans"] = 1
+    server["requests"].clear()
+    results = downloader.run(books)
+    assert results["1"] == str(tmp_path / "1.acsm")
+    assert results["3"] == str(tmp_path / "3.acsm")
+    assert not any("unid=2" in url for url, _ in server["requests"])
+
+
+def test_bulk_download_resume_after_failure(client, server, account, tmp_path):
+    server["body"] = b"<html>error</html>"
+    downloader = MLOLBulkDownloader(client, str(tmp_path))
+    assert downloader.run([_make_book("2", "available")]) == {"2": None}
+    assert os.listdir(tmp_path) == []
+
+    server["body"] = ACSM
+    assert downloader.run([_make_book("2", "available")]) == {
+        "2": str(tmp_path / "2.acsm")
+    }
+
+
+def test_download_owned_book_without_loan(client, server, account):
+    account["loans"] = []
+    book = _make_book("1", "owned")
+    assert client.iter_book_download(book) is None
+    assert client.download_book(book) is None
+    assert server["requests"] == []
+
+
+def test_bulk_download_partial_failure(client, server, account, tmp_path, monkeypatch):
+    send = HTTPAdapter.send
+
+    def failing_send(adapter, request, **kwargs):
+        if "unid=3" in request.url:
+            response = requests.Response()
+            response.request, response.url = request, request.url
+            response.status_code = 500
+            response.raw = io.BytesIO(b"")
+            return response
+        return send(adapter, request, **kwargs)
+
+    def get_book_by_id(book_id, *, fields=None):
+        if book_id == "bad":
+            raise requests.exceptions.HTTPError("404 Client Error")
+        return _make_book(book_id, "available")
+
+    monkeypatch.setattr(HTTPAdapter, "send", failing_send)
+    monkeypatch.setattr(client, "get_book_by_id", get_book_by_id)
+    account["remaining_loans"] = 3
+    # no loan ID for this owned book
+    account["loans"] = []
+    books = [_make_book("1", "owned"), _make_book("2", "available")]
+    books += [_make_book("3", "available"), "bad", "5"]
+    results = MLOLBulkDownloader(client, str(tmp_path)).run(books)
+    assert results == {
+        "1": None,
+        "2": str(tmp_path / "2.acsm"),
+        "3": None,
+        "bad": None,
+        "5": str(tmp_path / "5.acsm"),
+    }
@@ -0,0 +1,102 @@
+import os
+
+import pytest
+import vcr
+from pytest_cases import parametrize_with_cases
+
+from mlol_client import MLOLClient
+from mlol_client.mlol_constants import DEFAULT_HTML_PARSER, HTML_PARSERS
+
+from test_book_cases import (
+    case_book,
+    case_book_multiple_authors,
+    case_book_multiple_formats_adobe_drm,
+    case_book_multiple_formats_nodrm,
+    case_book_social_drm,
+)
+
+CASSETTE_BASE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "cassettes"
+)
+OTHER_PARSERS = [p for p in HTML_PARSERS if p != DEFAULT_HTML_PARSER]
+
+
+def get_client(parser, **kwargs):
+    try:
+        return MLOLClient(parser=parser, **kwargs)
+    except ValueError:
+        pytest.skip(f"{parser} is not installed")
+
+
+def as_dicts(objects):
+    return [o.to_dict() for o in objects]
+
+
+def test_unknown_parser():
+    with pytest.raises(ValueError):
+        MLOLClient(parser="regex")
+
+
+@pytest.mark.parametrize("parser", OTHER_PARSERS)
+@parametrize_with_cases(
+    "book_id, expected",
+    cases=[
+        case_book,
+        case_book_multiple_authors,
+        case_book_multiple_formats_adobe_drm,
+        case_book_multiple_formats_nodrm,
+        case_book_social_drm,
+    ],
+)
+def test_book_parser_equivalence(parser, book_id, expected, current_cases):
+    case_id = current_cases["book_id"].id
+    cassette = os.path.join(
+        CASSETTE_BASE_PATH, "test_book", f"test_book[{case_id}].yaml"
+    )
+    client = get_client(parser)
+    with vcr.use_cassette(cassette, record_mode="none", allow_playback_repeats=True):
+        reference = MLOLClient().get_book_by_id(book_id)
+        candidate = client.get_book_by_id(book_id)
+
+    assert candidate.to_dict() == reference.to_dict()
+
+
+@pytest.mark.parametrize("parser", OTHER_PARSERS)
+@pytest.mark.parametrize(
+    "cassette, query",
+    [
+        ("no_search_results.yaml", "asdqwedasdzxc"),
+        ("search_results_single_page.yaml", "quammen"),
+        ("search_results_multiple_pages.yaml", "filosofia"),
+    ],
+)
+def test_search_parser_equivalence(parser, cassette, query):
+    client = get_client(parser)
+    with vcr.use_cassette(
+        os.path.join(CASSETTE_BASE_PATH, "test_search", cassette),
+        record_mode="none",
+        allow_playback_repeats=True,
+    ):
+        reference = [b for page in MLOLClient().search_books(query) for b in page]
+        candidate = [b for page in client.search_books(query) for b in page]
+
+    assert as_dicts(candidate) == as_dicts(reference)
+
+
+@pytest.mark.parametrize("parser", OTHER_PARSERS)
+def test_reservation_parser_equivalence(parser):
+    domain = "csbno.medialibrary.it"
+    client = get_client(parser, domain=domain)
+    with vcr.use_cassette(
+        os.path.join(CASSETTE_BASE_PATH, "resources", "resources.yaml"),
+        record_mode="none",
+        allow_playback_repeats=True,
+    ):
+        reference_client = MLOLClient(domain=domain)
+        reference = reference_client.resolve_queue_positions(
+            reference_client._get_reservations()
+        )
+        candidate = client.resolve_queue_positions(client._get_reservations())
+
+    assert len(reference) == 2
+    assert as_dicts(candidate) == as_dicts(reference)
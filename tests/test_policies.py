@@ -0,0 +1,89 @@
+import os
+
+import pytest
+import vcr
+from requests.adapters import HTTPAdapter
+
+from mlol_client import MLOLBook, MLOLClient, MLOLDeadlineExceeded, deadline
+from mlol_client.mlol_policies import _remaining_time
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    # timeout and retries of each request, without sending it
+    sent = []
+
+    def send(adapter, request, timeout=None, **kwargs):
+        sent.append((request.url, timeout, adapter.max_retries))
+        raise ConnectionError
+
+    monkeypatch.setattr(HTTPAdapter, "send", send)
+    return sent
+
+
+def test_endpoint_policies(sent):
+    client = MLOLClient()
+    with pytest.raises(ConnectionError):
+        client.get_book_by_id("150208516")
+    with pytest.raises(ConnectionError):
+        next(client.search_books("quammen"))
+
+    (_, book_timeout, book_retries), (_, search_timeout, _) = sent
+    assert book_timeout == (5, 15) and search_timeout == (5, 20)
+    # ids that don't exist aren't retried
+    assert 404 not in book_retries.status_forcelist
+    assert 503 in book_retries.status_forcelist
+
+
+def test_deadline_timeouts(sent):
+    with deadline(2):
+        with pytest.raises(ConnectionError):
+            MLOLClient().get_book_by_id("150208516")
+
+    _, (connect, read), retries = sent[0]
+    assert connect <= 2 and read <= 2
+    # no time for retries and their backoff
+    assert retries.total == 0
+
+
+def test_nested_deadline():
+    with deadline(60):
+        with deadline(0.5):
+            assert _remaining_time() <= 0.5
+        with deadline(120):
+            assert 0.5 < _remaining_time() <= 60
+    assert _remaining_time() is None
+
+
+def test_deadline_exceeded(sent):
+    client = MLOLClient(domain="csbno.medialibrary.it")
+    client.api_token = "token"
+    # raised from the worker threads, before any request is sent
+    with pytest.raises(MLOLDeadlineExceeded):
+        client.get_resources(deep=True, deadline=0)
+    with pytest.raises(TimeoutError):
+        client.get_resources(deadline=0)
+    assert sent == []
+
+
+def test_deep_search_deadline(monkeypatch):
+    client = MLOLClient()
+    remaining = []
+
+    def get_book_by_id(book_id, *, fields=None):
+        remaining.append(_remaining_time())
+        return MLOLBook(id=book_id, title="")
+
+    monkeypatch.setattr(client, "get_book_by_id", get_book_by_id)
+    cassette_path = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)),
+        "cassettes",
+        "test_search",
+        "search_results_single_page.yaml",
+    )
+    with vcr.use_cassette(cassette_path, record_mode="none"):
+        books = next(client.search_books("quammen", deep=True, deadline=5))
+
+    # details are fetched by worker threads, within the deadline of the page
+    assert len(remaining) == len(books) > 0
+    assert all(r is not None and 0 < r <= 5 for r in remaining)
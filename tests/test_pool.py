@@ -0,0 +1,159 @@
+import io
+import os
+import threading
+import time
+
+import pytest
+import requests
+import vcr
+from requests.adapters import HTTPAdapter
+
+from mlol_client import MLOLClient, MLOLClientPool
+
+CASSETTE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    "cassettes",
+    "resources",
+    "resources.yaml",
+)
+DOMAIN = "csbno.medialibrary.it"
+ACCOUNTS = [
+    {"domain": DOMAIN, "username": f"user{i}", "password": "pass"} for i in range(3)
+]
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # the cassette only needs a token to be present, not a valid one
+    def authenticate(client, username, password, library_id):
+        client.session.cookies.set(".ASPXAUTH", username)
+        client.api_token = "token"
+        return True
+
+    monkeypatch.setattr(MLOLClient, "_authenticate", authenticate)
+    return MLOLClientPool(ACCOUNTS, max_concurrency=2)
+
+
+def test_pool_shared_resources(pool):
+    assert len(pool) == 3
+    clients = list(pool.clients.values())
+    assert all(c.cache is pool.cache for c in clients)
+    web_adapters = {id(c.session.get_adapter(c.session.base_url)) for c in clients}
+    api_adapters = {id(c.api_session.get_adapter("https://")) for c in clients}
+    assert len(web_adapters) == len(api_adapters) == 1
+    # sessions (and their cookies) are still separate
+    assert len({id(c.session) for c in clients}) == 3
+
+
+def test_pool_failed_logins(monkeypatch):
+    def authenticate(client, username, password, library_id):
+        if username != "user1":
+            client.session.cookies.set(".ASPXAUTH", username)
+            client.api_token = "token"
+        return True
+
+    monkeypatch.setattr(MLOLClient, "_authenticate", authenticate)
+    pool = MLOLClientPool(ACCOUNTS)
+    assert list(pool.clients) == [f"user0@{DOMAIN}", f"user2@{DOMAIN}"]
+    assert pool.failed == [f"user1@{DOMAIN}"]
+
+    # failed accounts are not queried
+    monkeypatch.setattr(MLOLClient, "get_user", lambda client: client.username)
+    assert pool.get_users_all() == {
+        f"user0@{DOMAIN}": "user0",
+        f"user2@{DOMAIN}": "user2",
+    }
+
+
+def test_pool_get_resources_all(pool):
+    with vcr.use_cassette(
+        CASSETTE_PATH,
+        record_mode="none",
+        filter_query_parameters=["token"],
+        allow_playback_repeats=True,
+    ):
+        resources = pool.get_resources_all()
+
+    assert list(resources) == [f"user{i}@{DOMAIN}" for i in range(3)]
+    assert all(len(r["active_loans"]) == 1 for r in resources.values())
+
+
+def test_pool_failures(pool, monkeypatch):
+    def get_resources(**kwargs):
+        raise ConnectionError
+
+    monkeypatch.setattr(pool["user1@" + DOMAIN], "get_resources", get_resources)
+    with vcr.use_cassette(
+        CASSETTE_PATH,
+        record_mode="none",
+        filter_query_parameters=["token"],
+        allow_playback_repeats=True,
+    ):
+        resources = pool.get_resources_all()
+
+    assert resources["user1@" + DOMAIN] is None
+    assert resources["user0@" + DOMAIN] is not None
+
+
+def test_pool_concurrency_budget(pool, monkeypatch):
+    # every account fetches its resources in parallel, requests in flight
+    # are still limited per host
+    lock = threading.Lock()
+    in_flight = {"current": 0, "max": 0}
+
+    def send(adapter, request, **kwargs):
+        with lock:
+            in_flight["current"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["current"])
+        time.sleep(0.02)
+        with lock:
+            in_flight["current"] -= 1
+        response = requests.Response()
+        response.request, response.url = request, request.url
+        response.status_code = 200
+        response.headers["Content-Type"] = "application/json"
+        response.raw = io.BytesIO(b'{"loans": []}')
+        return response
+
+    monkeypatch.setattr(HTTPAdapter, "send", send)
+    resources = pool.get_resources_all()
+    assert all(r is not None for r in resources.values())
+    # web and API hosts, max_concurrency=2 each
+    assert in_flight["max"] <= 4
+
+
+def test_pool_cache_statuses(pool, monkeypatch):
+    # user0 already borrowed the book, user1 can borrow it
+    statuses = {"user0": "Ripeti download", "user1": "Scarica"}
+    pages = []
+
+    def send(adapter, request, **kwargs):
+        username = request.headers["Cookie"].split(".ASPXAUTH=")[1].split(";")[0]
+        pages.append(username)
+        response = requests.Response()
+        response.request, response.url = request, request.url
+        response.status_code = 200
+        response.headers["Content-Type"] = "text/html; charset=utf-8"
+        response.raw = io.BytesIO(
+            f'<h1 class="book-title">Spillover</h1>'
+            f'<div class="panel-mlol">{statuses[username]}</div>'.encode()
+        )
+        return response
+
+    monkeypatch.setattr(HTTPAdapter, "send", send)
+    user0, user1 = pool["user0@" + DOMAIN], pool["user1@" + DOMAIN]
+    assert user0.get_book_by_id("1").status == "owned"
+    assert user1.get_book_by_id("1").status == "available"
+    assert pages == ["user0", "user1"]
+
+    # each account gets its own status from the cache, metadata is shared
+    assert user0.get_book_by_id("1").status == "owned"
+    assert user1.get_book_by_id("1").status == "available"
+    assert user1.get_book_by_id("1", fields=["title"]).title == "Spillover"
+    assert pages == ["user0", "user1"]
+
+    # a new loan changes the status for every account
+    user1._invalidate_book_status("1")
+    assert user0.get_book_by_id("1", fields=["title"]).status is None
+    assert user0.get_book_by_id("1").status == "owned"
+    assert pages == ["user0", "user1", "user0"]
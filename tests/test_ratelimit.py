@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+
+import pytest
+import vcr
+
+from mlol_client import MLOLClient, MLOLDeadlineExceeded, MLOLRateLimiter, deadline
+
+CASSETTE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    "cassettes",
+    "test_search",
+    "search_results_single_page.yaml",
+)
+URL = "https://medialibrary.it/media/ricerca.aspx"
+
+
+def test_aimd():
+    limiter = MLOLRateLimiter(rate=1000, max_concurrency=8)
+    with limiter.limit(URL) as report:
+        report(429)
+    assert limiter.stats["medialibrary.it"]["concurrency"] == 4
+
+    # additive increase: about one more slot per window of successful requests
+    for _ in range(5):
+        with limiter.limit(URL) as report:
+            report(200)
+    assert limiter.stats["medialibrary.it"]["concurrency"] == 5
+    for _ in range(50):
+        with limiter.limit(URL) as report:
+            report(200)
+    assert limiter.stats["medialibrary.it"]["concurrency"] == 8
+
+
+def test_concurrency_limit():
+    limiter = MLOLRateLimiter(rate=1000, max_concurrency=2)
+    peak = 0
+
+    def request():
+        nonlocal peak
+        with limiter.limit(URL) as report:
+            peak = max(peak, limiter.stats["medialibrary.it"]["in_flight"])
+            time.sleep(0.05)
+            report(200)
+
+    threads = [threading.Thread(target=request) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak == 2
+
+
+def test_rate_per_domain():
+    limiter = MLOLRateLimiter(
+        rate=1000, domains={"api.medialibrary.it": {"rate": 20, "burst": 1}}
+    )
+    start = time.monotonic()
+    for _ in range(5):
+        with limiter.limit("https://api.medialibrary.it/app/profile"):
+            pass
+    # the first request uses the burst, the others wait for a token
+    assert time.monotonic() - start >= 4 / 20
+
+    start = time.monotonic()
+    for _ in range(5):
+        with limiter.limit(URL):
+            pass
+    assert time.monotonic() - start < 4 / 20
+
+
+def test_client_rate_limiter():
+    limiter = MLOLRateLimiter()
+    client = MLOLClient(rate_limiter=limiter)
+    assert client.session.get_adapter(URL).rate_limiter is limiter
+    assert client.api_session.get_adapter(URL).rate_limiter is limiter
+
+    with vcr.use_cassette(CASSETTE_PATH, record_mode="none"):
+        assert len(next(client.search_books("quammen"))) > 0
+    assert limiter.stats == {"medialibrary.it": {"concurrency": 8, "in_flight": 0}}
+
+
+def test_deadline_while_waiting():
+    limiter = MLOLRateLimiter(rate=1000, max_concurrency=1)
+    with limiter.limit(URL) as report:
+        # paused by Retry-After, then no free slot: both waits are cut short
+        report(429, retry_after=10)
+    for hold_slot in (False, True):
+        start = time.monotonic()
+        if hold_slot:
+            limiter._get_limiter("medialibrary.it")._paused_until = 0
+            limiter._get_limiter("medialibrary.it").in_flight += 1
+        with pytest.raises(MLOLDeadlineExceeded), deadline(0.1):
+            with limiter.limit(URL):
+                pass
+        assert time.monotonic() - start < 1
+    assert limiter.stats["medialibrary.it"]["in_flight"] == 1
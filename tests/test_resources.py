@@ -1,8 +1,18 @@
 import os
 
+import pytest
 import vcr
 from pytest_cases import parametrize_with_cases, fixture
 
+from mlol_client import MLOLBook, MLOLClient
+
+CASSETTE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    "cassettes",
+    "resources",
+    "resources.yaml",
+)
+
 
 def validate_dict(candidate, expected):
     # are all values from expected in candidate?
@@ -13,17 +23,15 @@ def validate_dict(candidate, expected):
 def resources(client_auth):
     # we are recording this data once, and test expected values have to be dependent on the data we have at the moment
     with vcr.use_cassette(
-        os.path.join(
-            os.path.dirname(os.path.realpath(__file__)),
-            "cassettes",
-            "resources",
-            "resources.yaml",
-        ),
+        CASSETTE_PATH,
         record_mode="none",
         filter_headers=["Cookie", "Set-Cookie"],
         filter_query_parameters=["token"],
     ):
-        return client_auth.get_resources()
+        resources = client_auth.get_resources()
+        # queue positions are lazy, resolve them while the cassette is loaded
+        client_auth.resolve_queue_positions(resources["reservations"])
+        return resources
 
 
 def test_reservation_number(resources):
@@ -34,7 +42,7 @@ def test_reservation_number(resources):
 def test_reservation(resources, index, expected):
     candidate = resources["reservations"][index]
 
-    book_dict = candidate.book.__dict__
+    book_dict = candidate.book.to_dict()
     date = candidate.date.__str__()
     other_values = [candidate.id, candidate.status, candidate.queue_position]
 
@@ -47,3 +55,84 @@ def test_reservation(resources, index, expected):
         and date == expected_date
         and other_values == expected_other_values
     )
+
+
+@fixture
+def offline_client():
+    # the cassette only needs a token to be present, not a valid one
+    client = MLOLClient(domain="csbno.medialibrary.it")
+    client.api_token = "token"
+    return client
+
+
+def test_resources_concurrent(offline_client):
+    with vcr.use_cassette(
+        CASSETTE_PATH, record_mode="none", filter_query_parameters=["token"]
+    ):
+        resources = offline_client.get_resources()
+
+    assert {k: len(v) for k, v in resources.items()} == {
+        "reservations": 2,
+        "active_loans": 1,
+        "loan_history": 4,
+    }
+
+
+def test_resources_deep_deduplication(offline_client, monkeypatch):
+    fetched_ids = []
+
+    def get_book_by_id(book_id, *, fields=None):
+        fetched_ids.append(book_id)
+        return MLOLBook(id=book_id, title="")
+
+    monkeypatch.setattr(offline_client, "get_book_by_id", get_book_by_id)
+    with vcr.use_cassette(
+        CASSETTE_PATH, record_mode="none", filter_query_parameters=["token"]
+    ):
+        resources = offline_client.get_resources(deep=True)
+
+    book_ids = [item.book.id for v in resources.values() for item in v]
+    assert sorted(fetched_ids) == sorted(set(book_ids))
+
+
+def test_lazy_queue_positions(offline_client):
+    with vcr.use_cassette(CASSETTE_PATH, record_mode="none") as cassette:
+        reservations = offline_client._get_reservations()
+        assert cassette.play_count == 1
+        assert not any(r.queue_position_loaded for r in reservations)
+
+        assert reservations[0].queue_position == 1
+        offline_client.resolve_queue_positions(reservations)
+        assert cassette.play_count == 3
+
+    assert all(r.queue_position_loaded for r in reservations)
+
+
+def test_resources_include(offline_client):
+    with vcr.use_cassette(
+        CASSETTE_PATH, record_mode="none", filter_query_parameters=["token"]
+    ) as cassette:
+        resources = offline_client.get_resources(include={"active_loans"})
+        # no resources page, queue positions or loan history
+        assert cassette.play_count == 1
+
+    assert list(resources) == ["active_loans"]
+    with pytest.raises(ValueError):
+        offline_client.get_resources(include={"loans"})
+
+
+def test_loan_id_lookup(offline_client):
+    with vcr.use_cassette(
+        CASSETTE_PATH,
+        record_mode="none",
+        filter_query_parameters=["token"],
+        allow_playback_repeats=True,
+    ) as cassette:
+        (loan,) = offline_client._get_active_loans()
+        assert offline_client._get_loan_id(loan.book.id) == loan.id
+        # served by the loans fetched above
+        assert cassette.play_count == 1
+
+        # unknown books may have been borrowed in the meantime
+        assert offline_client._get_loan_id("0") is None
+        assert cassette.play_count == 2
@@ -61,11 +61,19 @@ def search_results_single_page_deep(client):
     return results
 
 
+@fixture
+@parametrize("client", [fixture_ref("client_no_auth")])
+def search_results_single_page_iter_deep(client):
+    # not recorded either: detail pages complete in any order
+    return list(client.search_books_iter(ONE_PAGE_QUERY, deep=True, ordered=False))
+
+
 @parametrize(
     "search_results",
     [
         fixture_ref(search_results_single_page),
         fixture_ref(search_results_single_page_deep),
+        fixture_ref(search_results_single_page_iter_deep),
     ],
 )
 def test_single_page_results_length(search_results):
@@ -118,3 +126,58 @@ def search_results_multiple_pages(client):
 
 def test_multiple_page_results_length(search_results_multiple_pages):
     assert len(search_results_multiple_pages) > PAGE_SIZE
+
+
+@fixture
+@parametrize("client", [fixture_ref("client_no_auth")])
+def search_results_multiple_pages_prefetch(client):
+    with vcr.use_cassette(
+        os.path.join(CASSETTE_BASE_PATH, "search_results_multiple_pages.yaml"),
+        record_mode="none",
+    ):
+        results_generator = client.search_books(MULTIPLE_PAGES_QUERY, prefetch=4)
+        results = []
+        for page in results_generator:
+            results += page
+        return results
+
+
+def test_prefetch_results_order(
+    search_results_multiple_pages, search_results_multiple_pages_prefetch
+):
+    assert [b.id for b in search_results_multiple_pages_prefetch] == [
+        b.id for b in search_results_multiple_pages
+    ]
+
+
+def test_prefetch_early_close(client_no_auth):
+    with vcr.use_cassette(
+        os.path.join(CASSETTE_BASE_PATH, "search_results_multiple_pages.yaml"),
+        record_mode="none",
+    ):
+        results_generator = client_no_auth.search_books(
+            MULTIPLE_PAGES_QUERY, prefetch=4
+        )
+        first_page = next(results_generator)
+        second_page = next(results_generator)
+        results_generator.close()
+
+    assert len(first_page) == PAGE_SIZE and len(second_page) == PAGE_SIZE
+
+
+@fixture
+@parametrize("client", [fixture_ref("client_no_auth")])
+def search_results_multiple_pages_iter(client):
+    with vcr.use_cassette(
+        os.path.join(CASSETTE_BASE_PATH, "search_results_multiple_pages.yaml"),
+        record_mode="none",
+    ):
+        return list(client.search_books_iter(MULTIPLE_PAGES_QUERY))
+
+
+def test_search_iter_matches_pages(
+    search_results_multiple_pages, search_results_multiple_pages_iter
+):
+    assert [b.id for b in search_results_multiple_pages_iter] == [
+        b.id for b in search_results_multiple_pages
+    ]
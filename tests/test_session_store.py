@@ -0,0 +1,134 @@
+import json
+import multiprocessing
+import os
+import stat
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from mlol_client import MLOLClient, MLOLSessionStore
+from mlol_client.mlol_constants import API_ENDPOINTS, WEB_ENDPOINTS
+
+DOMAIN = "csbno.medialibrary.it"
+KEY = f"user@{DOMAIN}"
+
+
+def make_entry(cookie, token):
+    return {
+        "cookies": [
+            {"name": ".ASPXAUTH", "value": cookie, "domain": DOMAIN, "path": "/"}
+        ],
+        "api_token": token,
+        "library_id": "123",
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MLOLSessionStore(str(tmp_path / "sessions.json"))
+    store.set(KEY, make_entry("old", "old-token"))
+    return store
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # accepts only the "new" session, requests are recorded
+    requests_sent = []
+
+    def send(adapter, request, **kwargs):
+        requests_sent.append(request.url)
+        response = requests.Response()
+        response.request, response.url = request, request.url
+        if request.url.startswith(API_ENDPOINTS["userinfo"]):
+            response.status_code = 200 if "token=new-token" in request.url else 401
+            response.headers["Content-Type"] = "application/json"
+            response._content = b"{}"
+        elif ".ASPXAUTH=new" in request.headers.get("Cookie", ""):
+            response.status_code = 200
+        else:
+            response.status_code = 302
+            response.headers["Location"] = "/user/logform.aspx"
+        return response
+
+    monkeypatch.setattr(HTTPAdapter, "send", send)
+    return requests_sent
+
+
+@pytest.fixture
+def client(store, server, monkeypatch):
+    logins = []
+
+    def authenticate(client, username, password, library_id):
+        logins.append((username, password, library_id))
+        client.session.cookies.set(".ASPXAUTH", "new", domain=DOMAIN, path="/")
+        client.api_token = "new-token"
+        client._save_session()
+        return True
+
+    monkeypatch.setattr(MLOLClient, "_authenticate", authenticate)
+    client = MLOLClient(
+        domain=DOMAIN, username="user", password="pass", session_store=store
+    )
+    client.logins = logins
+    return client
+
+
+def test_store(store):
+    assert store.get(KEY)["api_token"] == "old-token"
+    assert stat.S_IMODE(os.stat(store.path).st_mode) == 0o600
+    with open(store.path) as f:
+        assert list(json.load(f)) == [KEY]
+
+    store.max_age = 0
+    assert store.get(KEY) is None
+    store.delete(KEY)
+    assert MLOLSessionStore(store.path).get(KEY) is None
+
+
+def test_restore_session(client, server):
+    assert client.is_logged_in()
+    assert client.library_id == "123"
+    assert client.api_token == "old-token"
+    assert client.logins == server == []
+
+
+def test_web_session_expired(client, store, server):
+    response = client.session.request("GET", url=WEB_ENDPOINTS["resources"])
+    assert response.status_code == 200
+    assert client.logins == [("user", "pass", "123")]
+    assert len(server) == 2
+    assert store.get(KEY)["cookies"][0]["value"] == "new"
+
+    # no more logins once the session is valid
+    client.session.request("GET", url=WEB_ENDPOINTS["resources"])
+    assert len(client.logins) == 1
+
+
+def test_api_token_expired(client, store, server):
+    assert client._api_request(method="GET", url=API_ENDPOINTS["userinfo"]) == {}
+    assert len(client.logins) == 1
+    assert store.get(KEY)["api_token"] == "new-token"
+
+
+def set_sessions(path, worker):
+    store = MLOLSessionStore(path)
+    for i in range(20):
+        store.set(f"user{worker}_{i}@{DOMAIN}", make_entry(str(i), str(i)))
+
+
+def test_session_store_processes(tmp_path):
+    path = str(tmp_path / "sessions.json")
+    # no lost updates with concurrent writers
+    processes = [
+        multiprocessing.Process(target=set_sessions, args=(path, w)) for w in range(4)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+    store = MLOLSessionStore(path)
+    with open(path, encoding="utf8") as f:
+        assert len(json.load(f)) == 80
+    assert store.get(f"user3_19@{DOMAIN}")["api_token"] == "19"
@@ -0,0 +1,74 @@
+import pickle
+from datetime import datetime
+
+import pytest
+
+from mlol_client import MLOLBook, MLOLLoan, MLOLReservation, MLOLUser
+
+BOOK = {
+    "id": "150208516",
+    "title": "Spillover. L'evoluzione delle pandemie",
+    "authors": ["David Quammen"],
+    "status": "available",
+    "publisher": "Adelphi",
+    "ISBNs": ["9788845982484", "9788845932045"],
+    "language": "italiano",
+    "description": None,
+    "categories": [["Scienze umane", "Storia", "Storia culturale e sociale"]],
+    "year": 2020,
+    "formats": ["epub"],
+    "drm": "adobe",
+}
+
+
+@pytest.mark.parametrize(
+    "obj",
+    [
+        MLOLBook(**BOOK),
+        MLOLLoan(
+            id="123",
+            book=MLOLBook(**BOOK),
+            start_date=datetime(2020, 12, 1),
+            end_date=datetime(2020, 12, 15),
+        ),
+        MLOLReservation(
+            id="1324096",
+            book=MLOLBook(id="150218115", title="Tornare a casa"),
+            date=datetime(2020, 7, 7, 15, 30),
+            status="active",
+            queue_position=1,
+        ),
+        MLOLUser(
+            id=1,
+            name="Mario",
+            surname="Rossi",
+            username="mrossi",
+            remaining_loans=2,
+            remaining_reservations=3,
+            expiration_date=datetime(2021, 1, 1),
+        ),
+    ],
+)
+def test_round_trip(obj):
+    cls = type(obj)
+    assert cls.from_dict(obj.to_dict()).to_dict() == obj.to_dict()
+    assert cls.from_tuple(obj.to_tuple()).to_dict() == obj.to_dict()
+    assert pickle.loads(pickle.dumps(obj)).to_dict() == obj.to_dict()
+
+
+def test_book_slots():
+    book = MLOLBook(**BOOK)
+    assert not hasattr(book, "__dict__")
+    with pytest.raises(AttributeError):
+        book.cover = "cover.jpg"
+
+
+def test_book_interning():
+    first = MLOLBook.from_dict(BOOK)
+    # strings built at runtime, as the parsers do
+    second = MLOLBook.from_dict(
+        {**BOOK, "publisher": "".join(["Adel", "phi"]), "language": "italia" + "no"}
+    )
+    assert first.publisher is second.publisher
+    assert first.language is second.language
+    assert first.categories[0][1] is second.categories[0][1]
@@ -0,0 +1,145 @@
+import pytest
+import requests
+
+from mlol_client import MLOLAvailabilityWatcher, MLOLBook, MLOLClient
+
+
+@pytest.fixture
+def library(monkeypatch):
+    # fake catalog: book ID -> status, plus a log of the requests made
+    library = {"statuses": {}, "search_pages": 1, "requests": [], "failing": set()}
+    client = MLOLClient(domain="csbno.medialibrary.it")
+    client.session.cookies.set(".ASPXAUTH", "auth")
+    client.api_token = "token"
+
+    def get_first_search_page(params):
+        library["requests"].append(("search", 1))
+        return None, library["search_pages"]
+
+    def search_books_paginated(*, req_params, pages, first_response, prefetch):
+        assert req_params["chkdispo"] == "on"
+        available = [
+            MLOLBook(id=book_id, title=None)
+            for book_id, status in library["statuses"].items()
+            if status == "available"
+        ]
+        for page in range(1, pages + 1):
+            if page > 1:
+                library["requests"].append(("search", page))
+            yield available if page == 1 else []
+
+    def get_books_by_id(book_ids, *, fields=None, errors=None):
+        assert fields == {"status"}
+        library["requests"].extend(("book", book_id) for book_id in book_ids)
+        for book_id in library["failing"] & set(book_ids):
+            errors[book_id] = requests.exceptions.ReadTimeout("timeout")
+        return {
+            book_id: MLOLBook(
+                id=book_id, title=None, status=library["statuses"][book_id]
+            )
+            for book_id in book_ids
+            if book_id not in library["failing"]
+        }
+
+    monkeypatch.setattr(client, "_get_first_search_page", get_first_search_page)
+    monkeypatch.setattr(client, "_search_books_paginated", search_books_paginated)
+    monkeypatch.setattr(client, "_get_books_by_id", get_books_by_id)
+    library["client"] = client
+    return library
+
+
+def test_watch_transitions(library):
+    library["statuses"] = {str(i): "taken" for i in range(10)}
+    changes = []
+    watcher = MLOLAvailabilityWatcher(
+        library["client"],
+        [MLOLBook(id=str(i), title=None, status="taken") for i in range(10)],
+        on_change=lambda book, old: changes.append((book.id, old, book.status)),
+        interval=0,
+    )
+
+    # one search page covers the whole watchlist
+    assert watcher.check() == []
+    assert library["requests"] == [("search", 1)]
+
+    library["statuses"]["3"] = "available"
+    library["requests"].clear()
+    watcher.check()
+    assert changes == [("3", "taken", "available")]
+    assert library["requests"] == [("search", 1)]
+
+    # books that leave the search are checked one by one
+    library["statuses"]["3"] = "owned"
+    library["requests"].clear()
+    watcher.check()
+    assert changes[-1] == ("3", "available", "owned")
+    assert library["requests"] == [("search", 1), ("book", "3")]
+    assert watcher.statuses["3"] == "owned"
+
+
+def test_watch_long_search(library):
+    # more search pages than books to check: book pages are cheaper
+    library["statuses"] = {"1": "taken", "2": "available"}
+    library["search_pages"] = 100
+    changes = []
+    watcher = MLOLAvailabilityWatcher(
+        library["client"],
+        ["1", "2"],
+        on_change=lambda book, old: changes.append((book.id, old, book.status)),
+        interval=0,
+    )
+
+    watcher.check()
+    # the first search page was used anyway, the rest are skipped
+    assert library["requests"] == [("search", 1), ("book", "1")]
+    assert sorted(changes) == [("1", None, "taken"), ("2", None, "available")]
+
+    library["requests"].clear()
+    watcher.check()
+    assert sorted(library["requests"]) == [("book", "1"), ("book", "2")]
+
+
+def test_watch_backoff(library):
+    library["statuses"] = {"1": "taken"}
+    library["client"].session.cookies.clear()
+    watcher = MLOLAvailabilityWatcher(
+        library["client"], ["1"], interval=10, max_interval=30, jitter=0
+    )
+
+    # the first check sets the status, later ones back off
+    for expected in (10, 15, 22.5, 30, 30):
+        watcher.check()
+        watcher._schedule = [(0, "1")]
+        assert watcher._intervals["1"] == expected
+
+    # not logged in: no available books search
+    assert {kind for kind, _ in library["requests"]} == {"book"}
+
+    library["statuses"]["1"] = "available"
+    watcher.check()
+    assert watcher._intervals["1"] == 10
+
+    watcher.remove("1")
+    assert watcher.check() == [] and len(watcher) == 0
+
+
+def test_watch_failures(library, monkeypatch):
+    library["statuses"] = {"1": "taken", "2": "taken"}
+    library["failing"] = {"1"}
+    library["client"].session.cookies.clear()
+    watcher = MLOLAvailabilityWatcher(library["client"], ["1", "2"], interval=0)
+
+    # a failed book is rescheduled, the others are checked
+    watcher.check()
+    assert watcher.statuses == {"1": None, "2": "taken"}
+    assert sorted(book_id for _, book_id in watcher._schedule) == ["1", "2"]
+
+    def get_books_by_id(book_ids, *, fields=None, errors=None):
+        raise requests.exceptions.ConnectionError("offline")
+
+    # a failed cycle puts all the due books back and doesn't stop run()
+    monkeypatch.setattr(library["client"], "_get_books_by_id", get_books_by_id)
+    assert watcher.check() == []
+    assert sorted(book_id for _, book_id in watcher._schedule) == ["1", "2"]
+    watcher.run(duration=0.05)
+    assert sorted(book_id for _, book_id in watcher._schedule) == ["1", "2"]